@@ -0,0 +1,41 @@
+# coding=utf-8
+"""
+Storage format for archived discussions: a discussion and all of its replies packed into one
+zlib-compressed JSON record, so loading a whole thread is a single row read.
+"""
+import json
+import zlib
+from datetime import datetime
+
+FORMAT_VERSION = 1
+
+
+def _time(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def pack_thread(posting, replies):
+    record = {
+        "v": FORMAT_VERSION,
+        "posting_id": posting["posting_id"],
+        "topic": posting["posting_topic"],
+        "message": posting["message"],
+        "replies": [[r["posting_id"], r["sender"], _time(r["posting_time"]), r["message"]]
+                    for r in sorted(replies, key=lambda r: (_time(r["posting_time"]) or "", r["posting_id"]))]
+    }
+    return zlib.compress(json.dumps(record, separators=(",", ":")).encode(), 9)
+
+
+def unpack_thread(payload):
+    record = json.loads(zlib.decompress(payload))
+    record["replies"] = [{
+        "posting_id": posting_id,
+        "sender": sender,
+        "posting_time": datetime.fromisoformat(posting_time) if posting_time else None,
+        "message": message
+    } for posting_id, sender, posting_time, message in record["replies"]]
+    return record
+
+
+def thread_text(posting, replies):
+    return posting["posting_topic"], posting["message"], "\n".join(r["message"] or "" for r in replies)
@@ -0,0 +1,52 @@
+# coding=utf-8
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def encode_key(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_key(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (AttributeError, TypeError, ValueError, binascii.Error):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def encode_cursor(posting_time, posting_id):
+    return encode_key(posting_time.isoformat(), posting_id)
+
+
+def decode_cursor(cursor):
+    values = decode_key(cursor, 2)
+    if values is None:
+        return None
+    try:
+        return datetime.fromisoformat(values[0]), values[1]
+    except (TypeError, ValueError):
+        return None
+
+
+def after(time_column, id_column, position):
+    """
+    Rows strictly after `position`, a decoded (time, id) cursor, in ascending (time, id) order. The
+    redundant bound on the time column alone lets SQLite seek its index instead of walking it.
+    """
+    position_time, position_id = position
+    return and_(time_column >= position_time,
+                or_(time_column > position_time, id_column > position_id))
+
+
+def before(time_column, id_column, position):
+    """Rows strictly before `position` in descending (time, id) order, see `after`."""
+    position_time, position_id = position
+    return and_(time_column <= position_time,
+                or_(time_column < position_time, id_column < position_id))
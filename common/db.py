@@ -0,0 +1,100 @@
+# coding=utf-8
+"""
+Storage configuration shared by the services: where each SQLite database lives, how its engine is
+pooled and which pragmas every new connection gets. Everything is read from the environment:
+
+    DB_DIR              directory holding the *.db files (default: repository root)
+    <NAME>_DB           path of one database, e.g. POSTING_DB=/data/posting.db
+    MAX_WORKERS         connections pooled per engine (default 10, nameko's max_workers default)
+    DB_JOURNAL_MODE     default wal
+    DB_SYNCHRONOUS      default normal
+    DB_BUSY_TIMEOUT     milliseconds to wait on a locked database, default 5000
+    DB_CACHE_SIZE       page cache, negative values are KiB, default -65536 (64 MiB)
+    DB_MMAP_SIZE        bytes of the file memory-mapped, default 268435456 (256 MiB)
+"""
+import logging
+import os
+
+from nameko.extensions import DependencyProvider
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+_log = logging.getLogger(__name__)
+
+DB_DIR = os.environ.get("DB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+POOL_SIZE = int(os.environ.get("MAX_WORKERS", 10))
+PRAGMAS = [
+    ("journal_mode", os.environ.get("DB_JOURNAL_MODE", "wal")),
+    ("synchronous", os.environ.get("DB_SYNCHRONOUS", "normal")),
+    ("busy_timeout", int(os.environ.get("DB_BUSY_TIMEOUT", 5000))),
+    ("cache_size", int(os.environ.get("DB_CACHE_SIZE", -65536))),
+    ("mmap_size", int(os.environ.get("DB_MMAP_SIZE", 268435456))),
+]
+
+
+def db_path(db_name):
+    return os.environ.get(db_name.split(".")[0].upper() + "_DB", os.path.join(DB_DIR, db_name))
+
+
+def apply_pragmas(dbapi_connection, connection_record=None):
+    cursor = dbapi_connection.cursor()
+    for name, value in PRAGMAS:
+        cursor.execute("PRAGMA {} = {}".format(name, value))
+    cursor.close()
+
+
+def make_engine(db_name):
+    # every worker reads and writes through its own DbSession; the overflow covers short-lived extra sessions
+    # such as the keyword index reload
+    engine = create_engine("sqlite:///" + db_path(db_name), poolclass=QueuePool, pool_size=POOL_SIZE,
+                           max_overflow=POOL_SIZE, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", apply_pragmas)
+    return engine
+
+
+def effective_settings(engine):
+    with engine.connect() as conn:
+        return dict((name, conn.execute("PRAGMA " + name).scalar()) for name, _ in PRAGMAS)
+
+
+class DbSession(DependencyProvider):
+    """
+    Gives each worker its own session, committed when the worker succeeds, rolled back when it
+    raises, and closed either way.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.sessions = {}
+
+    def setup(self):
+        engine = self.session_factory.kw["bind"]
+        _log.info("%s storage %s: pool %d, %s", self.container.service_name, engine.url.database, POOL_SIZE,
+                  ", ".join("{}={}".format(k, v) for k, v in effective_settings(engine).items()))
+        max_workers = self.container.max_workers
+        if max_workers > POOL_SIZE:
+            _log.warning("%s runs %d workers but its connection pool holds %d; set MAX_WORKERS=%d",
+                         self.container.service_name, max_workers, POOL_SIZE, max_workers)
+
+    def get_dependency(self, worker_ctx):
+        session = self.session_factory()
+        self.sessions[worker_ctx] = session
+        return session
+
+    def worker_result(self, worker_ctx, result=None, exc_info=None):
+        session = self.sessions.get(worker_ctx)
+        if session is None:
+            return
+        if exc_info is None:
+            try:
+                session.commit()
+            except Exception:
+                _log.exception("commit failed for %s", worker_ctx.entrypoint.method_name)
+                session.rollback()
+        else:
+            session.rollback()
+
+    def worker_teardown(self, worker_ctx):
+        session = self.sessions.pop(worker_ctx, None)
+        if session is not None:
+            session.close()
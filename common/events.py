@@ -0,0 +1,56 @@
+# coding=utf-8
+import logging
+import threading
+from uuid import uuid4
+
+from kombu import Connection, Queue
+from kombu.mixins import ConsumerMixin
+from nameko.standalone.events import get_event_exchange
+
+from common.rpc import CONFIG
+
+_log = logging.getLogger(__name__)
+
+
+class EventListener(ConsumerMixin):
+    """
+    Receives nameko events outside a nameko container, e.g. in the Flask gateway.
+    Each listener binds its own exclusive, auto-deleted queue, so every gateway process sees every event.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or CONFIG
+        self.connection = Connection(self.config['AMQP_URI'])
+        self.handlers = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, source_service, event_type, handler):
+        self.handlers[(source_service, event_type)] = handler
+
+    def get_consumers(self, Consumer, channel):
+        queues = []
+        for source_service, event_type in self.handlers:
+            queues.append(Queue(
+                "evt-{}-{}--gateway-{}".format(source_service, event_type, uuid4().hex),
+                exchange=get_event_exchange(source_service, self.config),
+                routing_key=event_type,
+                durable=False, auto_delete=True, exclusive=True
+            ))
+        return [Consumer(queues=queues, callbacks=[self.on_message], accept=['json'])]
+
+    def on_message(self, body, message):
+        source_service = message.delivery_info.get('exchange', '')[:-len(".events")]
+        handler = self.handlers.get((source_service, message.delivery_info.get('routing_key')))
+        try:
+            if handler:
+                handler(body)
+        except Exception:
+            _log.exception("event handler failed for %s", message.delivery_info)
+        message.ack()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name="event-listener", daemon=True)
+                self._thread.start()
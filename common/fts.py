@@ -0,0 +1,6 @@
+# coding=utf-8
+
+
+def make_match_query(keywords):
+    terms = ['"{}"*'.format(term.replace('"', '""')) for term in keywords.split()]
+    return " ".join(terms)
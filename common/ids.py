@@ -0,0 +1,141 @@
+# coding=utf-8
+"""
+Time-ordered unique IDs shared by the services.
+
+An ID is an optional prefix followed by 16 Crockford base32 characters: 48 bits of Unix time in
+milliseconds, a 10-bit worker number and a 20-bit sequence. IDs from one process are strictly
+increasing, and IDs from processes with different worker numbers never collide.
+
+Every process generating IDs needs a worker number no other running process holds. WORKER_ID
+(0-1023) sets it explicitly; otherwise the process claims the lowest free number in the
+worker_claim table of ids.db (created by ``python -m common.migrate``). The claim is made under
+SQLite's write lock, so processes starting together get different numbers, and it is released when
+the process exits. A claim left by a process that died without releasing it is reused once that
+pid is no longer running on its host. Processes on different hosts only share numbers through
+ids.db if they share the file; give them WORKER_ID ranges of their own otherwise.
+"""
+import atexit
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from time import time
+
+from common.db import db_path
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+WORKER_BITS = 10
+SEQUENCE_BITS = 20
+
+_log = logging.getLogger(__name__)
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+    return True
+
+
+def claim_worker_id(path):
+    """Claims the lowest worker number not held by a running process in the registry at path."""
+    if not os.path.exists(path):
+        raise RuntimeError("{} not found: run python -m common.migrate or set WORKER_ID".format(path))
+    host, pid = socket.gethostname(), os.getpid()
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        # take the write lock before reading, so two processes cannot pick the same free number
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            held = set(worker_id for worker_id, claim_host, claim_pid
+                       in conn.execute("SELECT worker_id, host, pid FROM worker_claim")
+                       if claim_host != host or _running(claim_pid))
+            worker_id = next((n for n in range(1 << WORKER_BITS) if n not in held), None)
+            if worker_id is None:
+                raise RuntimeError("all {} worker numbers in {} are claimed".format(1 << WORKER_BITS, path))
+            conn.execute("INSERT OR REPLACE INTO worker_claim (worker_id, host, pid, claimed_time) "
+                         "VALUES (?, ?, ?, ?)", (worker_id, host, pid, datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    atexit.register(release_worker_id, path, worker_id, host, pid)
+    _log.info("claimed worker number %d in %s", worker_id, path)
+    return worker_id
+
+
+def release_worker_id(path, worker_id, host, pid):
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            conn.execute("DELETE FROM worker_claim WHERE worker_id = ? AND host = ? AND pid = ?",
+                         (worker_id, host, pid))
+    finally:
+        conn.close()
+
+
+def process_worker_id():
+    if "WORKER_ID" in os.environ:
+        return int(os.environ["WORKER_ID"])
+    return claim_worker_id(db_path("ids.db"))
+
+
+class IdGenerator(object):
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < 1 << WORKER_BITS:
+            raise ValueError("worker_id must be in [0, {})".format(1 << WORKER_BITS))
+        self.worker_id = worker_id
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_value(self):
+        with self._lock:
+            ms = int(time() * 1000)
+            if ms > self._last_ms:
+                self._last_ms = ms
+                # start low in the range so the sequence has room to count up within the millisecond
+                self._sequence = random.getrandbits(SEQUENCE_BITS - 1)
+            else:
+                # same millisecond, or the clock went backwards: keep counting from the last ID
+                self._sequence += 1
+                if self._sequence >> SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | \
+                self._sequence
+
+    def new_id(self, prefix=""):
+        value = self.next_value()
+        chars = []
+        for _ in range(16):
+            chars.append(ALPHABET[value & 31])
+            value >>= 5
+        return prefix + "".join(reversed(chars))
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def new_id(prefix=""):
+    global _generator
+    generator = _generator
+    # created on first use, so importing needs no worker number; a forked child claims its own
+    if generator is None or generator.pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator.pid != os.getpid():
+                _generator = IdGenerator(process_worker_id())
+            generator = _generator
+    return generator.new_id(prefix)
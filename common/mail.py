@@ -0,0 +1,15 @@
+# coding=utf-8
+from nameko.standalone.events import event_dispatcher
+
+from common.rpc import CONFIG
+
+_dispatch = event_dispatcher(CONFIG)
+
+
+def send_mail(to, subject, content):
+    """
+    Queue a mail in the mail service outbox. Returns as soon as the event is published; delivery
+    happens in the background. This is for code outside nameko, i.e. the gateway; services dispatch
+    mail_requested through their own EventDispatcher.
+    """
+    _dispatch("mail_service", "mail_requested", {"to": to, "subject": subject, "content": content})
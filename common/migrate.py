@@ -0,0 +1,444 @@
+# coding=utf-8
+"""
+Versioned schema migrations for the service databases.
+
+Each database tracks the last applied step in ``PRAGMA user_version``. A step is a list of SQL
+statements or callables taking the open connection, applied in one transaction. Run
+
+    python -m common.migrate            # upgrade every database in place
+    python -m common.migrate --check    # fail if a service's hot query still scans a whole table
+"""
+import argparse
+import importlib
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Session
+
+from common.archive_format import pack_thread, thread_text
+from common.db import db_path, apply_pragmas
+
+# databases that only exist once migrated, created empty when missing
+CREATED_DATABASES = {"ids.db", "mail.db"}
+
+
+def rollup_trigger(name, event, condition, row, kind, delta):
+    bucket = "strftime('%Y-%m-%d %H:00:00.000000', {}.posting_time)".format(row)
+    return (
+        "CREATE TRIGGER IF NOT EXISTS {name} {event} WHEN {condition} BEGIN "
+        "INSERT INTO posting_rollup (bucket, sender, kind, n) VALUES ({bucket}, {row}.sender, '{kind}', {delta}) "
+        "ON CONFLICT (bucket, kind, sender) DO UPDATE SET n = n + ({delta}); END"
+    ).format(name=name, event=event, condition=condition, bucket=bucket, row=row, kind=kind, delta=delta)
+
+
+def pack_archived_threads(conn):
+    conn.row_factory = sqlite3.Row
+    postings = conn.execute("SELECT * FROM archived_posting").fetchall()
+    for posting in postings:
+        replies = conn.execute("SELECT * FROM archived_reply WHERE discussion_id = ?",
+                               (posting["discussion_id"],)).fetchall()
+        cursor = conn.execute(
+            "INSERT INTO archived_thread (discussion_id, posting_id, sender, posting_time, group_id, reply_count, "
+            "payload) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (posting["discussion_id"], posting["posting_id"], posting["sender"], posting["posting_time"],
+             posting["group_id"], len(replies), pack_thread(posting, replies)))
+        conn.execute("INSERT INTO archive_fts (rowid, topic, message, replies) VALUES (?, ?, ?, ?)",
+                     (cursor.lastrowid,) + thread_text(posting, replies))
+    conn.row_factory = None
+
+
+def fill_moderation_queue(conn):
+    # the queue denormalizes events and users, which live in event.db and user.db next to posting.db
+    db_dir = os.path.dirname(conn.execute("PRAGMA database_list").fetchone()[2])
+    with sqlite3.connect(os.path.join(db_dir, "event.db")) as events:
+        pending = dict(events.execute("SELECT event_id, event_type FROM events WHERE event_status = 'processing' "
+                                      "AND event_type IN ('posting', 'private_request')").fetchall())
+    items = [("posting",) + row for row in conn.execute(
+        "SELECT event_id, posting_id, posting_time, sender, NULL, posting_topic, message FROM posting "
+        "WHERE posting_type = 'discussion' AND posting_status = 'processing'")]
+    items += [("private_request",) + row for row in conn.execute(
+        "SELECT event_id, conversation_id, posting_time, patient_id, physician_id, topic, message "
+        "FROM private_conversation WHERE status = 'processing'")]
+    items = [item for item in items if pending.get(item[1]) == item[0]]
+    with sqlite3.connect(os.path.join(db_dir, "user.db")) as users:
+        user_ids = set(item[4] for item in items) | set(item[5] for item in items if item[5])
+        names = {}
+        for user_id in user_ids:
+            names[user_id] = users.execute("SELECT user_name, user_email FROM users WHERE user_id = ?",
+                                           (user_id,)).fetchone() or (None, None)
+    for item_type, event_id, item_id, request_time, sender_id, physician_id, topic, message in items:
+        physician = names[physician_id] if physician_id else (None, None)
+        conn.execute("INSERT OR REPLACE INTO moderation_queue (event_id, item_type, item_id, request_time, sender_id, "
+                     "sender_name, sender_email, physician_id, physician_name, physician_email, topic, message) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (event_id, item_type, item_id, request_time, sender_id) + tuple(names[sender_id]) +
+                     (physician_id,) + tuple(physician) + (topic, message))
+
+
+def verify_pending_registrations(conn):
+    # the same checks as EventService.verify_registrations, for register events queued before it existed
+    db_dir = os.path.dirname(conn.execute("PRAGMA database_list").fetchone()[2])
+    events = conn.execute("SELECT event_id, target, additional_info FROM events WHERE event_type = 'register' "
+                          "AND event_status = 'processing' AND verified_time IS NULL").fetchall()
+    if not events:
+        return
+    with sqlite3.connect(os.path.join(db_dir, "user.db")) as users:
+        people = {}
+        for _, user_id, _ in events:
+            row = users.execute("SELECT user_firstname, user_lastname, user_type FROM users WHERE user_id = ?",
+                                (user_id,)).fetchone()
+            if row:
+                people[user_id] = row
+    with sqlite3.connect(os.path.join(db_dir, "hospital.db")) as hospital:
+        directory = dict((hospital_id, ((firstname or "").lower(), (lastname or "").lower()))
+                         for hospital_id, firstname, lastname in
+                         hospital.execute("SELECT hospital_id, firstname, lastname FROM users"))
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    for event_id, user_id, hospital_id in events:
+        if user_id not in people:
+            continue
+        first_name, last_name, user_type = people[user_id]
+        name = directory.get(hospital_id)
+        exists = name is not None
+        name_match = exists and name == ((first_name or "").lower(), (last_name or "").lower())
+        conn.execute("UPDATE events SET is_valid = ?, name_match = ?, physician_exist = ?, verified_time = ? "
+                     "WHERE event_id = ?",
+                     (exists, name_match, exists if user_type == "patient" else None, now, event_id))
+
+
+MIGRATIONS = {
+    "posting.db": [
+        (1, "indexes for feed, reply, moderation and report queries", [
+            "CREATE INDEX IF NOT EXISTS ix_posting_group_type_time ON posting (group_id, posting_type, posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_posting_type_time ON posting (posting_type, posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_posting_discussion_id ON posting (discussion_id)",
+            "CREATE INDEX IF NOT EXISTS ix_posting_event_id ON posting (event_id)",
+            "CREATE INDEX IF NOT EXISTS ix_reply_discussion_time ON reply (discussion_id, posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_reply_time_sender ON reply (posting_time, sender)",
+            "CREATE INDEX IF NOT EXISTS ix_private_conversation_patient_id ON private_conversation (patient_id)",
+            "CREATE INDEX IF NOT EXISTS ix_private_conversation_physician_id ON private_conversation (physician_id)",
+            "CREATE INDEX IF NOT EXISTS ix_private_conversation_event_id ON private_conversation (event_id)",
+            "CREATE INDEX IF NOT EXISTS ix_private_message_conversation_time "
+            "ON private_message (conversation_id, posting_time)",
+        ]),
+        (2, "full-text index over posting topics, posting messages and reply messages", [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posting_fts USING fts5("
+            "posting_topic, message, content='posting', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS reply_fts USING fts5("
+            "message, content='reply', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+            "CREATE TRIGGER IF NOT EXISTS posting_fts_ai AFTER INSERT ON posting BEGIN "
+            "INSERT INTO posting_fts (rowid, posting_topic, message) "
+            "VALUES (new.rowid, new.posting_topic, new.message); END",
+            "CREATE TRIGGER IF NOT EXISTS posting_fts_ad AFTER DELETE ON posting BEGIN "
+            "INSERT INTO posting_fts (posting_fts, rowid, posting_topic, message) "
+            "VALUES ('delete', old.rowid, old.posting_topic, old.message); END",
+            "CREATE TRIGGER IF NOT EXISTS posting_fts_au AFTER UPDATE OF posting_topic, message ON posting BEGIN "
+            "INSERT INTO posting_fts (posting_fts, rowid, posting_topic, message) "
+            "VALUES ('delete', old.rowid, old.posting_topic, old.message); "
+            "INSERT INTO posting_fts (rowid, posting_topic, message) "
+            "VALUES (new.rowid, new.posting_topic, new.message); END",
+            "CREATE TRIGGER IF NOT EXISTS reply_fts_ai AFTER INSERT ON reply BEGIN "
+            "INSERT INTO reply_fts (rowid, message) VALUES (new.rowid, new.message); END",
+            "CREATE TRIGGER IF NOT EXISTS reply_fts_ad AFTER DELETE ON reply BEGIN "
+            "INSERT INTO reply_fts (reply_fts, rowid, message) VALUES ('delete', old.rowid, old.message); END",
+            "CREATE TRIGGER IF NOT EXISTS reply_fts_au AFTER UPDATE OF message ON reply BEGIN "
+            "INSERT INTO reply_fts (reply_fts, rowid, message) VALUES ('delete', old.rowid, old.message); "
+            "INSERT INTO reply_fts (rowid, message) VALUES (new.rowid, new.message); END",
+            "INSERT INTO posting_fts (posting_fts) VALUES ('rebuild')",
+            "INSERT INTO reply_fts (reply_fts) VALUES ('rebuild')",
+        ]),
+        (3, "stable (posting_time, posting_id) key for reply pagination", [
+            "DROP INDEX IF EXISTS ix_reply_discussion_time",
+            "CREATE INDEX IF NOT EXISTS ix_reply_discussion_time_id ON reply (discussion_id, posting_time, posting_id)",
+        ]),
+        (4, "termination time of discussions, used by the bulk archiver", [
+            "ALTER TABLE posting ADD COLUMN terminated_time DATETIME",
+            # not recorded before; a discussion cannot have been terminated before its last reply
+            "UPDATE posting SET terminated_time = coalesce((SELECT max(reply.posting_time) FROM reply "
+            "WHERE reply.discussion_id = posting.discussion_id), posting_time) WHERE posting_status = 'terminated'",
+            "CREATE INDEX IF NOT EXISTS ix_posting_status_terminated ON posting (posting_status, terminated_time)",
+        ]),
+        (5, "hourly report rollups maintained by triggers", [
+            "CREATE TABLE IF NOT EXISTS posting_rollup (bucket DATETIME NOT NULL, sender TEXT NOT NULL, "
+            "kind TEXT NOT NULL, n INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (bucket, kind, sender))",
+            "INSERT INTO posting_rollup (bucket, sender, kind, n) "
+            "SELECT strftime('%Y-%m-%d %H:00:00.000000', posting_time), sender, 'dissemination', count(*) FROM posting "
+            "WHERE posting_type = 'dissemination' GROUP BY 1, 2",
+            "INSERT INTO posting_rollup (bucket, sender, kind, n) "
+            "SELECT strftime('%Y-%m-%d %H:00:00.000000', posting_time), sender, 'discussion', count(*) FROM posting "
+            "WHERE posting_type = 'discussion' AND posting_status = 'open' GROUP BY 1, 2",
+            "INSERT INTO posting_rollup (bucket, sender, kind, n) "
+            "SELECT strftime('%Y-%m-%d %H:00:00.000000', posting_time), sender, 'reply', count(*) FROM reply GROUP BY 1, 2",
+            rollup_trigger("posting_rollup_dissemination_ai", "AFTER INSERT ON posting",
+                           "new.posting_type = 'dissemination'", "new", "dissemination", 1),
+            rollup_trigger("posting_rollup_dissemination_ad", "AFTER DELETE ON posting",
+                           "old.posting_type = 'dissemination'", "old", "dissemination", -1),
+            rollup_trigger("posting_rollup_discussion_ai", "AFTER INSERT ON posting",
+                           "new.posting_type = 'discussion' AND new.posting_status = 'open'", "new", "discussion", 1),
+            rollup_trigger("posting_rollup_discussion_ad", "AFTER DELETE ON posting",
+                           "old.posting_type = 'discussion' AND old.posting_status = 'open'", "old", "discussion", -1),
+            rollup_trigger("posting_rollup_discussion_opened", "AFTER UPDATE OF posting_status ON posting",
+                           "new.posting_type = 'discussion' AND new.posting_status = 'open' "
+                           "AND old.posting_status IS NOT 'open'", "new", "discussion", 1),
+            rollup_trigger("posting_rollup_discussion_closed", "AFTER UPDATE OF posting_status ON posting",
+                           "old.posting_type = 'discussion' AND old.posting_status = 'open' "
+                           "AND new.posting_status IS NOT 'open'", "old", "discussion", -1),
+            rollup_trigger("posting_rollup_reply_ai", "AFTER INSERT ON reply", "1", "new", "reply", 1),
+            rollup_trigger("posting_rollup_reply_ad", "AFTER DELETE ON reply", "1", "old", "reply", -1),
+        ]),
+        (6, "moderation queue read model for the admin dashboard", [
+            "CREATE TABLE IF NOT EXISTS moderation_queue (event_id TEXT PRIMARY KEY, item_type TEXT NOT NULL, "
+            "item_id TEXT NOT NULL, request_time DATETIME, sender_id TEXT, sender_name TEXT, sender_email TEXT, "
+            "physician_id TEXT, physician_name TEXT, physician_email TEXT, topic TEXT, message TEXT)",
+            "CREATE INDEX IF NOT EXISTS ix_moderation_queue_time ON moderation_queue (request_time, event_id)",
+            "CREATE INDEX IF NOT EXISTS ix_moderation_queue_type_time "
+            "ON moderation_queue (item_type, request_time, event_id)",
+            "CREATE INDEX IF NOT EXISTS ix_moderation_queue_sender_time "
+            "ON moderation_queue (sender_id, request_time, event_id)",
+            "CREATE INDEX IF NOT EXISTS ix_moderation_queue_item_id ON moderation_queue (item_id)",
+            fill_moderation_queue,
+        ]),
+    ],
+    "event.db": [
+        (1, "indexes for event list and cite lookups", [
+            "CREATE INDEX IF NOT EXISTS ix_events_type_status ON events (event_type, event_status, created_time)",
+            "CREATE INDEX IF NOT EXISTS ix_events_target ON events (target)",
+        ]),
+        (2, "hospital verification results stored on register events", [
+            "ALTER TABLE events ADD COLUMN is_valid BOOLEAN",
+            "ALTER TABLE events ADD COLUMN name_match BOOLEAN",
+            "ALTER TABLE events ADD COLUMN physician_exist BOOLEAN",
+            "ALTER TABLE events ADD COLUMN verified_time DATETIME",
+        ]),
+        (3, "verify register events queued before verification ran in the background", [
+            verify_pending_registrations,
+        ]),
+    ],
+    "user.db": [
+        (1, "indexes for group membership and user list queries", [
+            "CREATE INDEX IF NOT EXISTS ix_user_group_user_id ON user_group (user_id, group_id)",
+            "CREATE INDEX IF NOT EXISTS ix_users_type_status ON users (user_type, user_status)",
+        ]),
+        (2, "trigram and prefix indexes for user name search", [
+            "CREATE INDEX IF NOT EXISTS ix_users_name_lower ON users (lower(user_name))",
+            "CREATE INDEX IF NOT EXISTS ix_users_fullname_lower ON users (lower(user_fullname))",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+            "user_name, user_fullname, content='users', content_rowid='rowid', tokenize='trigram')",
+            "CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+            "INSERT INTO users_fts (rowid, user_name, user_fullname) "
+            "VALUES (new.rowid, new.user_name, new.user_fullname); END",
+            "CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+            "INSERT INTO users_fts (users_fts, rowid, user_name, user_fullname) "
+            "VALUES ('delete', old.rowid, old.user_name, old.user_fullname); END",
+            "CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF user_name, user_fullname ON users BEGIN "
+            "INSERT INTO users_fts (users_fts, rowid, user_name, user_fullname) "
+            "VALUES ('delete', old.rowid, old.user_name, old.user_fullname); "
+            "INSERT INTO users_fts (rowid, user_name, user_fullname) "
+            "VALUES (new.rowid, new.user_name, new.user_fullname); END",
+            "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+        ]),
+    ],
+    "archive.db": [
+        (1, "indexes for archived reply and sender lookups", [
+            "CREATE INDEX IF NOT EXISTS ix_archived_posting_sender_time ON archived_posting (sender, posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_archived_posting_time ON archived_posting (posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_archived_reply_discussion_time ON archived_reply (discussion_id, posting_time)",
+        ]),
+        (2, "full-text index over archived postings and replies", [
+            "CREATE INDEX IF NOT EXISTS ix_archived_posting_discussion_id ON archived_posting (discussion_id)",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS archived_posting_fts USING fts5("
+            "posting_topic, message, content='archived_posting', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS archived_reply_fts USING fts5("
+            "message, content='archived_reply', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+            "CREATE TRIGGER IF NOT EXISTS archived_posting_fts_ai AFTER INSERT ON archived_posting BEGIN "
+            "INSERT INTO archived_posting_fts (rowid, posting_topic, message) "
+            "VALUES (new.rowid, new.posting_topic, new.message); END",
+            "CREATE TRIGGER IF NOT EXISTS archived_posting_fts_ad AFTER DELETE ON archived_posting BEGIN "
+            "INSERT INTO archived_posting_fts (archived_posting_fts, rowid, posting_topic, message) "
+            "VALUES ('delete', old.rowid, old.posting_topic, old.message); END",
+            "CREATE TRIGGER IF NOT EXISTS archived_reply_fts_ai AFTER INSERT ON archived_reply BEGIN "
+            "INSERT INTO archived_reply_fts (rowid, message) VALUES (new.rowid, new.message); END",
+            "CREATE TRIGGER IF NOT EXISTS archived_reply_fts_ad AFTER DELETE ON archived_reply BEGIN "
+            "INSERT INTO archived_reply_fts (archived_reply_fts, rowid, message) "
+            "VALUES ('delete', old.rowid, old.message); END",
+            "INSERT INTO archived_posting_fts (archived_posting_fts) VALUES ('rebuild')",
+            "INSERT INTO archived_reply_fts (archived_reply_fts) VALUES ('rebuild')",
+        ]),
+        (3, "progress table for bulk archive jobs", [
+            "CREATE TABLE IF NOT EXISTS archive_job (job_id TEXT PRIMARY KEY, posting_ids TEXT, "
+            "terminated_before DATETIME, status TEXT DEFAULT 'queued', total INTEGER DEFAULT 0, "
+            "archived INTEGER DEFAULT 0, created_time DATETIME, finished_time DATETIME, error TEXT)",
+        ]),
+        (4, "pack each archived discussion and its replies into one compressed record", [
+            "CREATE TABLE IF NOT EXISTS archived_thread (thread_id INTEGER PRIMARY KEY, "
+            "discussion_id TEXT NOT NULL UNIQUE, posting_id TEXT NOT NULL, sender TEXT NOT NULL, "
+            "posting_time DATETIME, group_id TEXT NOT NULL, reply_count INTEGER DEFAULT 0, payload BLOB NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS ix_archived_thread_sender_time ON archived_thread (sender, posting_time)",
+            "CREATE INDEX IF NOT EXISTS ix_archived_thread_time ON archived_thread (posting_time, posting_id)",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5("
+            "topic, message, replies, content='', tokenize='unicode61 remove_diacritics 2')",
+            pack_archived_threads,
+            "DROP TABLE IF EXISTS archived_posting_fts",
+            "DROP TABLE IF EXISTS archived_reply_fts",
+            "DROP TABLE IF EXISTS archived_reply",
+            "DROP TABLE IF EXISTS archived_posting",
+        ]),
+    ],
+    "ids.db": [
+        (1, "worker numbers claimed by running processes", [
+            "CREATE TABLE IF NOT EXISTS worker_claim (worker_id INTEGER PRIMARY KEY, host TEXT NOT NULL, "
+            "pid INTEGER NOT NULL, claimed_time DATETIME)",
+        ]),
+    ],
+    "mail.db": [
+        (1, "outbox drained by the mail service", [
+            "CREATE TABLE IF NOT EXISTS mail_outbox (mail_id INTEGER PRIMARY KEY, recipient TEXT NOT NULL, "
+            "subject TEXT, content TEXT, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, "
+            "next_attempt DATETIME, claim TEXT, created_time DATETIME, sent_time DATETIME, error TEXT)",
+            "CREATE INDEX IF NOT EXISTS ix_mail_outbox_status_next ON mail_outbox (status, next_attempt)",
+            "CREATE INDEX IF NOT EXISTS ix_mail_outbox_claim ON mail_outbox (claim)",
+        ]),
+    ],
+}
+
+# Service modules whose hot_queries() are explained against each database by --check. Each returns
+# the queries built by the service's own query builders, so the check follows the SQL actually issued.
+QUERY_SOURCES = {
+    "posting.db": ["service.posting"],
+    "event.db": ["service.event"],
+    "user.db": ["service.user", "service.group"],
+    "archive.db": ["service.archive"],
+    "mail.db": ["service.mail"],
+}
+
+
+def locate(db_name, db_dir=None):
+    return os.path.join(db_dir, db_name) if db_dir else db_path(db_name)
+
+
+def connect(db_name, db_dir=None):
+    conn = sqlite3.connect(locate(db_name, db_dir), isolation_level=None)
+    apply_pragmas(conn)
+    return conn
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade(db_name, db_dir=None, log=print):
+    conn = connect(db_name, db_dir)
+    try:
+        version = current_version(conn)
+        for step, description, statements in MIGRATIONS.get(db_name, []):
+            if step <= version:
+                continue
+            log("{}: applying {} ({})".format(db_name, step, description))
+            conn.execute("BEGIN")
+            try:
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute("PRAGMA user_version = {:d}".format(step))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            version = step
+        return version
+    finally:
+        conn.close()
+
+
+def hot_queries(db_name):
+    session = Session()
+    queries = []
+    for module_name in QUERY_SOURCES.get(db_name, []):
+        queries.extend(importlib.import_module(module_name).hot_queries(session))
+    return queries
+
+
+def query_plan(conn, query):
+    compiled = getattr(query, "statement", query).compile(dialect=sqlite.dialect())
+    # the plan does not depend on the bound values, only on where the parameters are
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + str(compiled),
+                                            [None] * len(compiled.positiontup))]
+
+
+def plan_scans(plan, allow_index_walk=False):
+    """
+    Steps of an EXPLAIN QUERY PLAN that read a whole table: a plain SCAN, a SCAN ... USING INDEX that
+    walks a whole index (unless allow_index_walk) and a full-text table read without MATCH. Scans of
+    a subquery's own result are fine, its tables are checked by their own steps.
+    """
+    subqueries = set()
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if words[0] in ("CO-ROUTINE", "MATERIALIZE"):
+            subqueries.add(words[1])
+        if words[0] != "SCAN":
+            continue
+        if words[1] == "TABLE":
+            # SQLite before 3.36 says SCAN TABLE x
+            words = words[:1] + words[2:]
+        if words[1] in subqueries or words[1].startswith("(subquery") or words[1] in ("SUBQUERY", "CONSTANT"):
+            continue
+        if "VIRTUAL TABLE INDEX" in detail:
+            if "M" not in detail.rsplit(":", 1)[-1]:
+                scans.append(detail)
+        elif " USING " in detail:
+            if not allow_index_walk:
+                scans.append(detail)
+        else:
+            scans.append(detail)
+    return scans
+
+
+def full_scans(db_name, db_dir=None):
+    conn = connect(db_name, db_dir)
+    failures = []
+    try:
+        for name, query, *allow_index_walk in hot_queries(db_name):
+            try:
+                plan = query_plan(conn, query)
+            except sqlite3.OperationalError as e:
+                # e.g. a table or column a pending migration adds
+                failures.append((name, "cannot be planned: {}".format(e)))
+                continue
+            for detail in plan_scans(plan, *allow_index_walk):
+                failures.append((name, detail))
+    finally:
+        conn.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade service databases and check query plans.")
+    parser.add_argument("--db-dir", help="directory holding the databases, overrides DB_DIR and <NAME>_DB")
+    parser.add_argument("--check", action="store_true", help="only check that hot queries use an index")
+    args = parser.parse_args(argv)
+    failed = False
+    for db_name in sorted(MIGRATIONS):
+        if not os.path.exists(locate(db_name, args.db_dir)) and \
+                (args.check or db_name not in CREATED_DATABASES):
+            print("{}: not found, skipped".format(db_name))
+            continue
+        if args.check:
+            for name, detail in full_scans(db_name, args.db_dir):
+                print("{}: {} fails the plan check ({})".format(db_name, name, detail))
+                failed = True
+        else:
+            print("{}: at version {}".format(db_name, upgrade(db_name, args.db_dir)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
 # coding=utf-8
+import threading
+from collections import deque
+
+from nameko.events import EventDispatcher, event_handler, BROADCAST
+from nameko.extensions import DependencyProvider
 from nameko.rpc import rpc
 from sqlalchemy import Column, Text, Integer
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from common.db import DbSession, make_engine
+
 Base = declarative_base()
-engine = create_engine('sqlite:///../dict.db')
+engine = make_engine('dict.db')
 Session = sessionmaker()
 Session.configure(bind=engine)
 
@@ -18,13 +24,108 @@ class Keyword(Base):
     keyword = Column(Text, nullable=False, unique=True)
 
 
+class KeywordMatcher(object):
+    """Aho-Corasick automaton over a fixed keyword set, matching case-insensitively."""
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in set(k.lower() for k in keywords if k):
+            self._insert(keyword)
+        self._build_failure_links()
+
+    def _insert(self, keyword):
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(keyword)
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, *texts):
+        for text in texts:
+            if not text:
+                continue
+            state = 0
+            for char in text.lower():
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                state = self.goto[state].get(char, 0)
+                for keyword in self.output[state]:
+                    yield keyword
+
+    def search(self, *texts):
+        matched = []
+        for keyword in self.iter_matches(*texts):
+            if keyword not in matched:
+                matched.append(keyword)
+        return matched
+
+    def contains_any(self, *texts):
+        for _ in self.iter_matches(*texts):
+            return True
+        return False
+
+
+class KeywordIndex(DependencyProvider):
+    """
+    KeywordMatcher over dict.db's keywords, built when the service starts and rebuilt when the
+    keyword list changes. Workers get the provider; `matcher` is always a complete automaton.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.matcher = None
+        self._lock = threading.Lock()
+
+    def setup(self):
+        self.reload()
+
+    def reload(self):
+        # rebuilds are serialized so a slow, older rebuild cannot replace a newer one
+        with self._lock:
+            session = self.session_factory()
+            try:
+                keywords = [entry[0] for entry in session.query(Keyword.keyword)]
+            finally:
+                session.close()
+            self.matcher = KeywordMatcher(keywords)
+        return self.matcher
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+
 class KeywordService(object):
     name = "keyword_service"
-    querySession = Session()
+    querySession = DbSession(Session)
+    keywords = KeywordIndex(Session)
+    dispatch = EventDispatcher()
+
+    @event_handler("keyword_service", "keywords_changed", handler_type=BROADCAST, reliable_delivery=False)
+    def on_keywords_changed(self, payload):
+        self.keywords.reload()
 
-    @classmethod
-    def has_this_keyword(cls, keyword):
-        return cls.querySession.query(Keyword).filter(Keyword.keyword == keyword.lower()).first()
+    def has_this_keyword(self, keyword):
+        return self.querySession.query(Keyword).filter(Keyword.keyword == keyword.lower()).first()
 
     @rpc
     def get_all_keywords(self):
@@ -36,31 +137,32 @@ class KeywordService(object):
 
     @rpc
     def add_a_keyword(self, keyword):
-        session = Session()
+        session = self.querySession
         if self.has_this_keyword(keyword) is not None:
             return False
         new_word = Keyword(keyword=keyword.lower())
         session.add(new_word)
         session.commit()
+        self.keywords.reload()
+        self.dispatch("keywords_changed", keyword.lower())
         return True
 
     @rpc
     def remove_a_keyword(self, keyword):
-        session = Session()
-        if self.has_this_keyword(keyword) is None:
+        session = self.querySession
+        deleted_word = self.has_this_keyword(keyword)
+        if deleted_word is None:
             return False
-        deleted_word = session.query(Keyword).filter(Keyword.keyword == keyword.lower()).first()
         session.delete(deleted_word)
         session.commit()
+        self.keywords.reload()
+        self.dispatch("keywords_changed", keyword.lower())
         return True
 
     @rpc
     def check_discussion_posting(self, message, topic=None):
-        for result in self.querySession.query(Keyword):
-            if message.find(result.keyword) >= 0:
-                return True
-        if topic:
-            for result in self.querySession.query(Keyword):
-                if topic.find(result.keyword) >= 0:
-                    return True
-        return False
+        return self.keywords.matcher.contains_any(message, topic)
+
+    @rpc
+    def match_keywords(self, message, topic=None):
+        return self.keywords.matcher.search(message, topic)
@@ -1,22 +1,28 @@
 # coding=utf-8
 from datetime import datetime
-from hashlib import sha1
-from time import time
 
+from nameko.events import event_handler
 from nameko.rpc import rpc
-from sqlalchemy import Column, Text, DateTime
-from sqlalchemy import create_engine
+from sqlalchemy import Column, Text, DateTime, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from common.db import DbSession, make_engine
+from common.ids import new_id
+from common.rpc import rpc_pool
+
 Base = declarative_base()
-engine = create_engine('sqlite:///../event.db')
+engine = make_engine('event.db')
 Session = sessionmaker()
 Session.configure(bind=engine)
 
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        Index("ix_events_type_status", "event_type", "event_status", "created_time"),
+        Index("ix_events_target", "target"),
+    )
 
     event_id = Column(Text, primary_key=True)
     event_type = Column(Text, nullable=False)
@@ -26,25 +32,22 @@ class Event(Base):
     operated_time = Column(DateTime)
     event_status = Column(Text, default="processing")
     additional_info = Column(Text)
+    is_valid = Column(Boolean)
+    name_match = Column(Boolean)
+    physician_exist = Column(Boolean)
+    verified_time = Column(DateTime)
 
 
 class EventService(object):
     name = "event_service"
-    querySession = Session()
-
-    @staticmethod
-    def generate_event_id():
-        now = datetime.now().strftime("%Y%m%d")
-        sha1_obj = sha1()
-        sha1_obj.update(str(time()).encode())
-        return "{}{}".format(now, sha1_obj.hexdigest()[:7])
+    querySession = DbSession(Session)
 
     @rpc
     def add_event(self, event_type, initiator, target=None, created_time=datetime.now(), event_status='processing',
                   ts=False,
                   operated=False, additional_info=None):
-        session = Session()
-        event_id = self.generate_event_id()
+        session = self.querySession
+        event_id = new_id()
         new_event = Event(
             event_id=event_id,
             event_type=event_type,
@@ -86,11 +89,14 @@ class EventService(object):
         event = self.get_event_info(event_id)
         return event['event_status'] if event else None
 
+    @staticmethod
+    def events_query(session, event_type, status):
+        return session.query(Event).filter(Event.event_type == event_type, Event.event_status == status)
+
     @rpc
     def get_all_events(self, event_type, status='processing'):
         data = []
-        for event in self.querySession.query(Event).filter(Event.event_type == event_type,
-                                                           Event.event_status == status):
+        for event in self.events_query(self.querySession, event_type, status):
             data.append({
                 "event_id": event.event_id,
                 "initiator": event.initiator,
@@ -102,19 +108,78 @@ class EventService(object):
         return data
 
     @rpc
-    def get_cite_event(self, posting_id):
-        cite_event = self.querySession.query(Event) \
+    def get_register_list(self):
+        data = []
+        for event in self.events_query(self.querySession, "register", "processing"):
+            data.append({
+                "event_id": event.event_id,
+                "initiator": event.initiator,
+                "target": event.target,
+                "created_time": event.created_time.strftime("%Y-%m-%d %H:%M %p"),
+                "additional_info": event.additional_info,
+                "verified": event.verified_time is not None,
+                "is_valid": event.is_valid,
+                "name_match": event.name_match,
+                "physician_exist": event.physician_exist
+            })
+        return data
+
+    @event_handler("user_service", "user_registered")
+    def on_user_registered(self, payload):
+        self.verify_registrations([payload["event_id"]])
+
+    @staticmethod
+    def unverified_query(session):
+        return session.query(Event).filter(Event.event_type == "register", Event.event_status == "processing",
+                                           Event.verified_time.is_(None))
+
+    @rpc
+    def verify_registrations(self, event_ids=None):
+        """
+        Runs the hospital checks for register events and stores the results on them. Without event_ids,
+        every pending register event that has not been verified yet is checked.
+        """
+        session = self.querySession
+        if event_ids is None:
+            events = self.unverified_query(session).all()
+        else:
+            events = [event for i in range(0, len(event_ids), 500)
+                      for event in session.query(Event).filter(Event.event_type == "register",
+                                                               Event.event_id.in_(event_ids[i:i + 500]))]
+        if not events:
+            return 0
+        with rpc_pool.acquire() as _rpc:
+            users = _rpc.user_service.get_users_info([event.target for event in events])
+            events = [event for event in events if event.target in users]
+            results = _rpc.hospital_service.verify_many([
+                [event.additional_info, users[event.target]['first_name'], users[event.target]['last_name']]
+                for event in events
+            ])
+        now = datetime.now()
+        for event, result in zip(events, results):
+            event.is_valid = result["exists"]
+            event.name_match = result["name_match"]
+            event.physician_exist = result["exists"] if users[event.target]['user_type'] == "patient" else None
+            event.verified_time = now
+        session.commit()
+        return len(events)
+
+    @staticmethod
+    def cite_event_query(session, posting_id):
+        return session.query(Event) \
             .filter(Event.event_type == 'cite') \
             .filter(Event.target == posting_id) \
-            .filter(Event.event_status == 'processing') \
-            .first()
+            .filter(Event.event_status == 'processing')
+
+    @rpc
+    def get_cite_event(self, posting_id):
+        cite_event = self.cite_event_query(self.querySession, posting_id).first()
         if cite_event:
             return self.get_event_info(cite_event.event_id)
         return None
 
-    @classmethod
-    def operate_event(cls, event_id, status):
-        session = Session()
+    def operate_event(self, event_id, status):
+        session = self.querySession
         event = session.query(Event).filter(Event.event_id == event_id).first()
         if not event:
             return False
@@ -132,3 +197,12 @@ class EventService(object):
     @rpc
     def reject(self, event_id):
         return self.operate_event(event_id, "rejected")
+
+
+def hot_queries(session):
+    """See `common.migrate --check`."""
+    return [
+        ("get_all_events", EventService.events_query(session, "cite", "processing")),
+        ("get_cite_event", EventService.cite_event_query(session, "p")),
+        ("verify_registrations", EventService.unverified_query(session)),
+    ]
@@ -1,49 +1,87 @@
 # coding=utf-8
+import os
+import sqlite3
+import threading
+from time import time
+from types import MappingProxyType
+from urllib.request import pathname2url
+
+from nameko.extensions import DependencyProvider
 from nameko.rpc import rpc
-from sqlalchemy import Column, Text, Date
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import exists
-
-Base = declarative_base()
-engine = create_engine('sqlite:///../hospital.db')
-Session = sessionmaker()
-Session.configure(bind=engine)
-
-
-class HospitalUser(Base):
-    __tablename__ = "users"
-
-    hospital_id = Column(Text, primary_key=True)
-    firstname = Column(Text, nullable=False)
-    lastname = Column(Text, nullable=False)
-    mailing_address = Column(Text)
-    emails = Column(Text)
-    phones = Column(Text)
-    date_of_birth = Column(Date)
-    gender = Column(Text)
-    department = Column(Text)
-    physician_name = Column(Text)
-    diagnosis = Column(Text)
+
+from common.db import PRAGMAS, db_path
+
+
+class HospitalDirectory(DependencyProvider):
+    """
+    Read-only index of hospital.db, hospital_id -> (lowercased first name, lowercased last name), loaded
+    when the service starts and rebuilt when the file's mtime changes. Workers get the current index.
+    """
+
+    def __init__(self, path=None, check_interval=None):
+        self.path = path or db_path("hospital.db")
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.environ.get("HOSPITAL_RELOAD_INTERVAL", 5))
+        self.index = MappingProxyType({})
+        self._mtime = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def setup(self):
+        self.load()
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        # immutable: the file is treated as a snapshot, so SQLite takes no locks and we reopen on change
+        conn = sqlite3.connect("file:{}?mode=ro&immutable=1".format(pathname2url(os.path.abspath(self.path))),
+                               uri=True)
+        try:
+            conn.execute("PRAGMA mmap_size = {:d}".format(dict(PRAGMAS)["mmap_size"]))
+            index = dict((hospital_id, ((firstname or "").lower(), (lastname or "").lower()))
+                         for hospital_id, firstname, lastname in
+                         conn.execute("SELECT hospital_id, firstname, lastname FROM users"))
+        finally:
+            conn.close()
+        self.index = MappingProxyType(index)
+        self._mtime = mtime
+        return self.index
+
+    def current(self):
+        now = time()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    if os.stat(self.path).st_mtime_ns != self._mtime:
+                        self.load()
+        return self.index
+
+    def get_dependency(self, worker_ctx):
+        return self.current()
 
 
 class HospitalService(object):
     name = "hospital_service"
-    querySession = Session()
+    directory = HospitalDirectory()
 
     @rpc
     def is_user_exist(self, user_id):
-        return self.querySession.query(exists().where(HospitalUser.hospital_id == user_id)).scalar()
+        return user_id in self.directory
 
     @rpc
     def check_user_name(self, user_id, first_name, last_name):
-        if not self.is_user_exist(user_id):
-            return False
-        check_user = self.querySession.query(HospitalUser).filter(HospitalUser.hospital_id == user_id).first()
-        flag = True
-        if check_user.firstname.lower() != first_name.lower():
-            flag = False
-        if check_user.lastname.lower() != last_name.lower():
-            flag = False
-        return flag
+        return self.directory.get(user_id) == (first_name.lower(), last_name.lower())
+
+    @rpc
+    def verify_many(self, checks):
+        """
+        checks: list of [hospital_id, first_name, last_name]; returns one {"exists", "name_match"} per check.
+        """
+        results = []
+        for hospital_id, first_name, last_name in checks:
+            name = self.directory.get(hospital_id)
+            results.append({
+                "exists": name is not None,
+                "name_match": name is not None and name == ((first_name or "").lower(), (last_name or "").lower())
+            })
+        return results
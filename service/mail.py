@@ -1,13 +1,204 @@
 # coding=utf-8
-import yagmail
+import os
+import smtplib
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from uuid import uuid4
+
+from nameko.events import event_handler
 from nameko.rpc import rpc
+from nameko.timer import timer
+from sqlalchemy import Column, Integer, Text, DateTime, Index, or_
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from common.db import DbSession, make_engine
+
+Base = declarative_base()
+engine = make_engine('mail.db')
+Session = sessionmaker()
+Session.configure(bind=engine)
+
+POLL_INTERVAL = float(os.environ.get("MAIL_POLL_INTERVAL", 2))
+BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 8))
+RETRY_BACKOFF = float(os.environ.get("MAIL_RETRY_BACKOFF", 30))
+CLAIM_TIMEOUT = float(os.environ.get("MAIL_CLAIM_TIMEOUT", 300))
+
+
+class OutboxMail(Base):
+    __tablename__ = "mail_outbox"
+    __table_args__ = (
+        Index("ix_mail_outbox_status_next", "status", "next_attempt"),
+        Index("ix_mail_outbox_claim", "claim"),
+    )
+
+    mail_id = Column(Integer, primary_key=True)
+    recipient = Column(Text, nullable=False)
+    subject = Column(Text)
+    content = Column(Text)
+    status = Column(Text, default="pending")
+    attempts = Column(Integer, default=0)
+    next_attempt = Column(DateTime)
+    claim = Column(Text)
+    created_time = Column(DateTime)
+    sent_time = Column(DateTime)
+    error = Column(Text)
+
+
+class YagmailBackend(object):
+
+    def __init__(self):
+        self.smtp = None
+
+    def open(self):
+        if self.smtp is None:
+            # imported here so the smtp backend runs without yagmail installed
+            import yagmail
+            self.smtp = yagmail.SMTP(os.environ.get("MAIL_USER", "camellia.userservice@gmail.com"),
+                                     oauth2_file=os.environ.get("MAIL_OAUTH2_FILE", "./oauth2_creds.json"))
+
+    def send(self, to, subject, content):
+        self.smtp.send(to, subject, content)
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.close()
+            except smtplib.SMTPException:
+                pass
+            finally:
+                self.smtp = None
+
+
+class SmtpBackend(object):
+    """
+    Plain SMTP, e.g. a local stand-in such as `python -m aiosmtpd -n -l localhost:1025`.
+    """
 
-yag = yagmail.SMTP("camellia.userservice@gmail.com", oauth2_file='./oauth2_creds.json')
+    def __init__(self):
+        self.host = os.environ.get("MAIL_SMTP_HOST", "localhost")
+        self.port = int(os.environ.get("MAIL_SMTP_PORT", 1025))
+        self.sender = os.environ.get("MAIL_USER", "camellia.userservice@gmail.com")
+        self.smtp = None
+
+    def open(self):
+        if self.smtp is None:
+            self.smtp = smtplib.SMTP(self.host, self.port)
+
+    def send(self, to, subject, content):
+        message = MIMEText(content, "html")
+        message["From"] = self.sender
+        message["To"] = to
+        message["Subject"] = subject
+        self.smtp.sendmail(self.sender, [to], message.as_string())
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                self.smtp.close()
+            finally:
+                self.smtp = None
+
+
+BACKENDS = {
+    "yagmail": YagmailBackend,
+    "smtp": SmtpBackend
+}
 
 
 class MailService(object):
     name = "mail_service"
+    querySession = DbSession(Session)
+    backend = BACKENDS[os.environ.get("MAIL_BACKEND", "yagmail")]()
 
     @rpc
     def send_mail(self, to, subject, content):
-        yag.send(to, subject, content)
+        return self.enqueue(to, subject, content)
+
+    # the gateway publishes as mail_service through common.mail, the services through their dispatchers
+    @event_handler("mail_service", "mail_requested")
+    @event_handler("posting_service", "mail_requested")
+    @event_handler("user_service", "mail_requested")
+    def on_mail_requested(self, payload):
+        self.enqueue(payload["to"], payload["subject"], payload["content"])
+
+    def enqueue(self, to, subject, content):
+        session = self.querySession
+        now = datetime.now()
+        mail = OutboxMail(recipient=to, subject=subject, content=content, created_time=now, next_attempt=now)
+        session.add(mail)
+        session.commit()
+        return mail.mail_id
+
+    @timer(interval=POLL_INTERVAL)
+    def flush_outbox(self):
+        while self.send_batch() == BATCH_SIZE:
+            pass
+
+    @classmethod
+    def deliver(cls, mail):
+        cls.backend.open()
+        try:
+            cls.backend.send(mail.recipient, mail.subject, mail.content)
+        except smtplib.SMTPServerDisconnected:
+            # the reused connection was dropped by the server while idle
+            cls.backend.close()
+            cls.backend.open()
+            cls.backend.send(mail.recipient, mail.subject, mail.content)
+
+    @staticmethod
+    def due_query(session, now):
+        # a claim expires after CLAIM_TIMEOUT so a batch left behind by a crashed worker is picked up again
+        return session.query(OutboxMail.mail_id) \
+            .filter(or_(OutboxMail.status == "pending", OutboxMail.status == "sending")) \
+            .filter(OutboxMail.next_attempt <= now) \
+            .order_by(OutboxMail.next_attempt, OutboxMail.mail_id) \
+            .limit(BATCH_SIZE)
+
+    @staticmethod
+    def claimed_query(session, claim):
+        return session.query(OutboxMail).filter(OutboxMail.claim == claim).order_by(OutboxMail.mail_id)
+
+    def send_batch(self):
+        session = self.querySession
+        now = datetime.now()
+        claim = uuid4().hex
+        session.query(OutboxMail).filter(OutboxMail.mail_id.in_(self.due_query(session, now).subquery())) \
+            .update({"status": "sending", "claim": claim, "next_attempt": now + timedelta(seconds=CLAIM_TIMEOUT)},
+                    synchronize_session=False)
+        session.commit()
+        batch = self.claimed_query(session, claim).all()
+        for mail in batch:
+            try:
+                self.deliver(mail)
+            except Exception as e:
+                # drop the connection so the next mail starts from a fresh one
+                try:
+                    self.backend.close()
+                except Exception:
+                    pass
+                mail.attempts += 1
+                mail.error = repr(e)
+                if mail.attempts >= MAX_ATTEMPTS:
+                    mail.status = "failed"
+                else:
+                    mail.status = "pending"
+                    mail.next_attempt = datetime.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** (mail.attempts - 1))
+            else:
+                mail.status = "sent"
+                mail.sent_time = datetime.now()
+                mail.error = None
+            mail.claim = None
+            session.commit()
+        return len(batch)
+
+
+def hot_queries(session):
+    """See `common.migrate --check`."""
+    return [
+        ("mail.send_batch", MailService.due_query(session, datetime.now())),
+        ("mail.claimed", MailService.claimed_query(session, "c")),
+    ]
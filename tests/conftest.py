@@ -0,0 +1,92 @@
+# coding=utf-8
+import os
+import shutil
+import sys
+from contextlib import contextmanager, ExitStack
+from unittest import mock
+
+import pytest
+from nameko.testing.services import worker_factory
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from common import ids, migrate
+from common.rpc import rpc_pool
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASES = ["posting.db", "event.db", "user.db", "archive.db", "dict.db", "hospital.db"]
+
+
+@pytest.fixture(autouse=True)
+def worker_id(monkeypatch):
+    """Generated IDs use a fixed worker number instead of claiming one from the real ids.db."""
+    monkeypatch.setenv("WORKER_ID", "1")
+    monkeypatch.setattr(ids, "_generator", None)
+
+
+@pytest.fixture
+def raw_db_dir(tmp_path):
+    """Copies of the checked-in databases, as they are before any migration."""
+    for name in DATABASES:
+        shutil.copy(os.path.join(REPO, name), str(tmp_path / name))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def db_dir(raw_db_dir):
+    """Copies of the checked-in databases, migrated to the current schema."""
+    for name in DATABASES + sorted(migrate.CREATED_DATABASES):
+        migrate.upgrade(name, raw_db_dir, log=lambda message: None)
+    return raw_db_dir
+
+
+@pytest.fixture
+def make_session(db_dir):
+    """make_session("posting.db") returns a session on the migrated copy of that database."""
+    engines = []
+
+    def make(db_name):
+        engine = create_engine("sqlite:///" + os.path.join(db_dir, db_name))
+        engines.append(engine)
+        return sessionmaker(bind=engine)()
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def rpc():
+    """Stands in for the proxy every `rpc_pool.acquire()` hands out, in the gateway and the services."""
+    proxy = mock.MagicMock()
+
+    @contextmanager
+    def acquire():
+        yield proxy
+
+    with mock.patch.object(rpc_pool, "acquire", acquire):
+        yield proxy
+
+
+@pytest.fixture
+def make_service(make_session):
+    """
+    make_service(PostingService, "posting.db") returns a worker reading through a session on that copy, with
+    the sessions its module opens bound to the same copy. Other dependencies are passed on to worker_factory.
+    """
+    with ExitStack() as patches:
+        def make(service_cls, db_name, **dependencies):
+            session = make_session(db_name)
+            patches.enter_context(mock.patch.object(service_cls, "querySession", session))
+            patches.enter_context(mock.patch.object(sys.modules[service_cls.__module__], "Session",
+                                                    sessionmaker(bind=session.bind)))
+            return worker_factory(service_cls, **dependencies)
+
+        yield make
+
+
+@pytest.fixture
+def user_service(make_service):
+    from service.user import UserService
+
+    return make_service(UserService, "user.db")
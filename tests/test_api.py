@@ -0,0 +1,216 @@
+# coding=utf-8
+from unittest import mock
+
+import pytest
+
+from api import api
+
+
+@pytest.fixture(autouse=True)
+def gateway(rpc):
+    api.identity_cache.clear()
+    with mock.patch.object(api, "event_listener"):
+        yield
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def replies(method, results):
+    """Makes `method.call_async(arg)` return a reply whose result is results[arg]."""
+    method.call_async.side_effect = lambda arg: mock.Mock(**{"result.return_value": results[arg]})
+
+
+def user(user_id, name):
+    return {"user_id": user_id, "full_name": name}
+
+
+def test_cite_list_skips_postings_that_are_gone(rpc, client):
+    rpc.user_service.check_user_type_by_token.return_value = "admin"
+    rpc.event_service.get_all_events.return_value = [
+        {"event_id": "e1", "initiator": "u1", "target": "p1", "additional_info": "spam@@ads"},
+        {"event_id": "e2", "initiator": "u2", "target": "p2", "additional_info": "abuse@@insult"},
+    ]
+    replies(rpc.posting_service.get_posting_info, {
+        "p1": None,
+        "p2": {"posting_id": "p2", "sender": "u3", "posting_time": "01/02/2020 10:00 AM", "topic": "t",
+               "message": "m"},
+    })
+    rpc.user_service.get_users_info.return_value = {"u2": user("u2", "B"), "u3": user("u3", "C")}
+
+    body = client.get("/api/v1/getCiteList?token=t").get_json()
+
+    assert body["status"] == 20000
+    assert [cite["eventID"] for cite in body["data"]["cite_list"]] == ["e2"]
+    assert body["data"]["cite_list"][0]["senderName"] == "C"
+    assert body["data"]["cite_list"][0]["reason"] == "insult"
+    rpc.user_service.get_users_info.assert_called_once_with(["u2", "u3"])
+
+
+def test_cite_list_requires_admin(rpc, client):
+    rpc.user_service.check_user_type_by_token.return_value = "patient"
+
+    body = client.get("/api/v1/getCiteList?token=t").get_json()
+
+    assert body["status"] == 10001
+    rpc.event_service.get_all_events.assert_not_called()
+
+
+def test_user_type_is_looked_up_once(rpc, client):
+    rpc.user_service.check_user_type_by_id.return_value = "nurse"
+
+    first = client.get("/api/v1/checkUserType?userID=u1").get_json()
+    second = client.get("/api/v1/checkUserType?userID=u1").get_json()
+
+    assert first["data"] == second["data"] == {"usertype": "nurse"}
+    rpc.user_service.check_user_type_by_id.assert_called_once_with("u1")
+
+
+def test_unknown_user_is_not_cached(rpc, client):
+    rpc.user_service.check_user_type_by_id.return_value = None
+    client.get("/api/v1/checkUserType?userID=u1")
+    rpc.user_service.check_user_type_by_id.return_value = "nurse"
+
+    body = client.get("/api/v1/checkUserType?userID=u1").get_json()
+
+    assert body["data"] == {"usertype": "nurse"}
+
+
+def test_user_events_evict_cached_identities(rpc):
+    api.identity_cache.set(("token", "t1"), "admin")
+    api.identity_cache.set(("token", "t0"), "admin")
+    api.identity_cache.set(("id", "u1"), "admin")
+
+    api.on_user_status_changed({"user_id": "u1"})
+    assert api.identity_cache.get(("id", "u1")) is None
+
+    api.on_user_logged_in({"user_id": "u1", "token": "t1", "old_token": "t0"})
+    assert api.identity_cache.get(("token", "t0")) is None
+    assert api.identity_cache.get(("token", "t1")) is None
+
+    api.identity_cache.set(("token", "t1"), "admin")
+    api.on_user_logged_out({"user_id": "u1", "token": "t1"})
+    assert api.identity_cache.get(("token", "t1")) is None
+
+
+def test_logout_drops_the_cached_token(rpc, client):
+    api.identity_cache.set(("token", "t1"), "admin")
+    rpc.user_service.user_logout.return_value = True
+
+    client.get("/api/v1/logout?token=t1")
+
+    assert api.identity_cache.get(("token", "t1")) is None
+
+
+GROUPS = [{"gid": "PPA", "groupName": "Patients"}, {"gid": "NPA", "groupName": "Nurses"}]
+
+
+def test_posting_list_keeps_the_original_shape(rpc, client):
+    rpc.group_service.get_group_by_user_id.return_value = GROUPS
+    replies(rpc.posting_service.get_dissemination, {"PPA": [{"postingID": "p1"}], "NPA": [{"postingID": "p2"}]})
+    replies(rpc.posting_service.get_discussions, {"PPA": [{"postingID": "p3"}], "NPA": []})
+
+    disseminations = client.get("/api/v1/getPosting?type=dissemination&userID=u1").get_json()
+    discussions = client.get("/api/v1/getPosting?type=discussion&userID=u1").get_json()
+
+    assert disseminations["data"] == {"postings": [[{"postingID": "p1", "groupName": "Patients"}],
+                                                   [{"postingID": "p2", "groupName": "Nurses"}]]}
+    assert discussions["data"] == {"postings": [{"postingID": "p3", "groupName": "Patients"}]}
+    rpc.posting_service.get_feed.assert_not_called()
+
+
+def test_posting_list_pages_when_asked(rpc, client):
+    rpc.group_service.get_group_by_user_id.return_value = GROUPS
+    rpc.posting_service.get_feed.return_value = {"postings": [{"postingID": "p3"}], "next_cursor": "c2"}
+
+    body = client.get("/api/v1/getPosting?type=discussion&userID=u1&limit=1&cursor=c1").get_json()
+
+    assert body["data"] == {"postings": [{"postingID": "p3"}], "next_cursor": "c2"}
+    rpc.posting_service.get_feed.assert_called_once_with(["PPA", "NPA"], "discussion", limit=1, cursor="c1",
+                                                         group_names={"PPA": "Patients", "NPA": "Nurses"})
+
+
+def test_posting_list_reports_empty_and_bad_requests(rpc, client):
+    rpc.group_service.get_group_by_user_id.return_value = GROUPS
+    replies(rpc.posting_service.get_discussions, {"PPA": [], "NPA": []})
+    rpc.posting_service.get_feed.return_value = None
+
+    assert client.get("/api/v1/getPosting?type=discussion&userID=u1").get_json()["status"] == 10003
+    assert client.get("/api/v1/getPosting?type=discussion&userID=u1&cursor=x").get_json()["status"] == 10002
+
+
+def test_posting_search_is_one_call_for_all_groups(rpc, client):
+    rpc.group_service.get_group_by_user_id.return_value = GROUPS
+    rpc.posting_service.search_postings.return_value = [{"postingID": "p1"}]
+
+    body = client.post("/api/v1/searchPosting", json={"userID": "u1", "topic": "kidney", "from": "", "to": "",
+                                                       "sender": ""}).get_json()
+
+    assert body["data"] == {"result": [{"postingID": "p1"}]}
+    rpc.posting_service.search_postings.assert_called_once()
+    assert rpc.posting_service.search_postings.call_args[0][:2] == (["PPA", "NPA"], "kidney")
+    rpc.posting_service.search_posting.assert_not_called()
+    rpc.posting_service.get_replies.assert_not_called()
+
+
+REPORT_RANGE = {"start": "1577836800000", "end": "1580515200000"}
+
+
+def test_reports_for_a_user_type(rpc, client):
+    rpc.user_service.check_user_type_by_token.return_value = "admin"
+    rpc.user_service.get_user_list.return_value = [{"userID": "u1"}, {"userID": "u2"}]
+    rpc.posting_service.counting_report.return_value = {
+        "users": [{"user_id": "u1", "reply": 2}, {"user_id": "u2", "reply": 0}], "total_reply": 2}
+    rpc.user_service.get_users_info.return_value = {"u1": {"user_name": "ana"}}
+
+    body = client.post("/api/v1/getReports?token=t", json=dict(REPORT_RANGE, userType="nurse")).get_json()
+
+    assert [user["user_name"] for user in body["data"]["users"]] == ["ana", None]
+    rpc.posting_service.counting_report.assert_called_once_with(["u1", "u2"], 1577836800.0, 1580515200.0)
+    rpc.user_service.get_users_info.assert_called_once_with(["u1", "u2"])
+
+
+def test_reports_validate_their_input(rpc, client):
+    rpc.user_service.check_user_type_by_token.return_value = "admin"
+
+    assert client.post("/api/v1/getReports?token=t", json=REPORT_RANGE).get_json()["status"] == 10002
+    assert client.post("/api/v1/getReports?token=t",
+                       json={"start": "2020", "end": "2021", "userIDs": []}).get_json()["status"] == 10002
+    rpc.posting_service.counting_report.assert_not_called()
+
+    rpc.user_service.check_user_type_by_token.return_value = "nurse"
+    api.identity_cache.clear()
+    assert client.post("/api/v1/getReports?token=t", json=dict(REPORT_RANGE, userIDs=[])).get_json()["status"] == 10001
+
+
+def registration(event_id, target, verified, is_valid=None, name_match=None, physician_exist=None):
+    return {"event_id": event_id, "target": target, "created_time": "2020-01-01 10:00 AM", "additional_info": "H1",
+            "verified": verified, "is_valid": is_valid, "name_match": name_match, "physician_exist": physician_exist}
+
+
+def registrant(user_id, user_type):
+    return {"user_id": user_id, "first_name": "F", "last_name": "L", "user_name": user_id, "user_type": user_type,
+            "email": user_id + "@example.org", "mobile": "1"}
+
+
+def test_register_list_shows_pending_checks_without_running_them(rpc, client):
+    rpc.user_service.check_user_type_by_token.return_value = "admin"
+    rpc.event_service.get_register_list.return_value = [
+        registration("e1", "u1", True, 1, 0, 1),
+        registration("e2", "u2", False),
+        registration("e3", "u3", True, 1, 1, None),
+        registration("e4", "gone", False),
+    ]
+    rpc.user_service.get_users_info.return_value = {"u1": registrant("u1", "patient"),
+                                                    "u2": registrant("u2", "patient"),
+                                                    "u3": registrant("u3", "nurse")}
+
+    body = client.get("/api/v1/getRegisterList?token=t").get_json()
+
+    rows = [(row["eventID"], row["verified"], row["isValid"], row["nameMatch"], row["physicianExist"])
+            for row in body["data"]["register_list"]]
+    assert rows == [("e1", True, True, False, True), ("e2", False, None, None, None), ("e3", True, True, True, "")]
+    rpc.event_service.verify_registrations.assert_not_called()
+    rpc.hospital_service.verify_many.assert_not_called()
@@ -0,0 +1,49 @@
+# coding=utf-8
+import json
+from datetime import datetime
+
+from common.archive_format import FORMAT_VERSION, pack_thread, unpack_thread, thread_text
+
+POSTING = {"posting_id": "p1", "posting_topic": "Kidney diet", "message": "What should I eat?"}
+
+
+def reply(posting_id, posting_time, message="ok", sender="u1"):
+    return {"posting_id": posting_id, "sender": sender, "posting_time": posting_time, "message": message}
+
+
+def test_round_trip():
+    replies = [reply("r1", datetime(2020, 4, 23, 4, 19, 43, 186757), "less salt"),
+               reply("r2", datetime(2020, 4, 23, 5), "more water", sender="u2")]
+
+    record = unpack_thread(pack_thread(POSTING, replies))
+
+    assert record == {"v": FORMAT_VERSION, "posting_id": "p1", "topic": "Kidney diet",
+                      "message": "What should I eat?", "replies": replies}
+
+
+def test_replies_are_stored_in_time_then_id_order():
+    replies = [reply("r3", datetime(2020, 1, 2)), reply("r2", datetime(2020, 1, 1)),
+               reply("r1", datetime(2020, 1, 2)), reply("r0", None)]
+
+    record = unpack_thread(pack_thread(POSTING, replies))
+
+    assert [r["posting_id"] for r in record["replies"]] == ["r0", "r2", "r1", "r3"]
+
+
+def test_times_read_back_from_sqlite_text():
+    record = unpack_thread(pack_thread(POSTING, [reply("r1", "2020-04-23 04:19:43.186757")]))
+
+    assert record["replies"][0]["posting_time"] == datetime(2020, 4, 23, 4, 19, 43, 186757)
+
+
+def test_thread_is_compressed():
+    replies = [reply("r{}".format(i), datetime(2020, 1, 1, 0, i), "the same advice again") for i in range(50)]
+
+    payload = pack_thread(POSTING, replies)
+
+    assert len(payload) < len(json.dumps(replies, default=str)) / 4
+
+
+def test_thread_text_covers_topic_message_and_replies():
+    assert thread_text(POSTING, [reply("r1", None, "less salt"), reply("r2", None, None)]) == \
+        ("Kidney diet", "What should I eat?", "less salt\n")
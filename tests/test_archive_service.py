@@ -0,0 +1,164 @@
+# coding=utf-8
+from datetime import datetime, timedelta
+from itertools import count
+
+import pytest
+
+from service.archive import ArchiveService
+from service.user import User
+
+_ids = count()
+
+
+@pytest.fixture
+def archive_service(make_service, rpc, user_service):
+    rpc.user_service.get_users_info.side_effect = user_service.get_users_info
+    rpc.posting_service.purge_discussions.side_effect = len
+    return make_service(ArchiveService, "archive.db")
+
+
+@pytest.fixture
+def senders(user_service):
+    return [user_id for user_id, in user_service.querySession.query(User.user_id).limit(2)]
+
+
+def discussion(sender, topic, message, when, replies=()):
+    number = next(_ids)
+    posting = {"posting_id": "ptest{:04d}".format(number), "sender": sender, "posting_time": when.isoformat(),
+               "posting_topic": topic, "message": message, "group_id": "PPA",
+               "discussion_id": "dtest{:04d}".format(number)}
+    return posting, [{"posting_id": "rtest{:04d}".format(next(_ids)), "discussion_id": posting["discussion_id"],
+                      "sender": reply_sender, "posting_time": (when + timedelta(minutes=i + 1)).isoformat(),
+                      "message": reply_message} for i, (reply_sender, reply_message) in enumerate(replies)]
+
+
+def archive(service, rpc, *discussions):
+    rpc.posting_service.export_discussions.return_value = {
+        "postings": [dict(posting) for posting, _ in discussions],
+        "replies": [dict(reply) for _, replies in discussions for reply in replies]
+    }
+    return service.archive_chunk([posting["posting_id"] for posting, _ in discussions])
+
+
+def test_search_returns_threads_with_their_replies(archive_service, rpc, senders):
+    first, second = senders
+    archive(archive_service, rpc,
+            discussion(first, "Kelp diets", "anyone tried kelp?", datetime(2020, 1, 1),
+                       [(second, "yes, twice"), (first, "thanks")]),
+            discussion(second, "Sleep", "what about naps", datetime(2020, 1, 2), [(first, "kelpish naps")]),
+            discussion(second, "Walking", "daily walks", datetime(2020, 1, 3)))
+    rpc.user_service.get_users_info.reset_mock()
+
+    result = archive_service.search_archive("kelp", None, None, None)
+
+    assert result["next_cursor"] is None
+    assert [posting["topic"] for posting in result["result"]] == ["Sleep", "Kelp diets"]
+    assert [reply["message"] for reply in result["result"][1]["replies"]] == ["yes, twice", "thanks"]
+    assert rpc.user_service.get_users_info.call_count == 1
+
+
+def test_search_filters_by_sender_and_date(archive_service, rpc, senders):
+    first, second = senders
+    archive(archive_service, rpc,
+            discussion(first, "Fasting", "intermittent fasting", datetime(2020, 1, 1)),
+            discussion(second, "Fasting again", "fasting before tests", datetime(2020, 2, 1)))
+
+    by_sender = archive_service.search_archive("fasting", None, None, second)["result"]
+    by_date = archive_service.search_archive("fasting", datetime(2020, 1, 15).timestamp(), None, None)["result"]
+
+    assert [posting["senderID"] for posting in by_sender] == [second]
+    assert [posting["topic"] for posting in by_date] == ["Fasting again"]
+
+
+def test_search_pages_newest_first(archive_service, rpc, senders):
+    archive(archive_service, rpc, *[discussion(senders[0], "Page {}".format(i), "paged thread",
+                                               datetime(2020, 3, 1) + timedelta(days=i)) for i in range(5)])
+
+    topics = []
+    cursor = None
+    while True:
+        page = archive_service.search_archive("paged", None, None, None, limit=2, cursor=cursor)
+        topics.extend(posting["topic"] for posting in page["result"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert topics == ["Page 4", "Page 3", "Page 2", "Page 1", "Page 0"]
+    assert archive_service.search_archive("paged", None, None, None, cursor="garbage") is None
+
+
+def test_thread_replies_and_archiving_twice(archive_service, rpc, senders):
+    thread = discussion(senders[0], "Salt", "low salt", datetime(2020, 1, 1), [(senders[1], "how low?")])
+
+    assert archive(archive_service, rpc, thread) == 1
+    archive(archive_service, rpc, thread)
+
+    assert [reply["message"] for reply in archive_service.get_replies(thread[0]["discussion_id"])] == ["how low?"]
+    assert len(archive_service.search_archive("salt", None, None, None)["result"]) == 1
+    assert archive_service.get_replies("unknown") == []
+
+
+def exports(*discussions):
+    """Makes export_discussions return whichever of `discussions` it is asked for."""
+    by_id = dict((posting["posting_id"], (posting, replies)) for posting, replies in discussions)
+
+    def export_discussions(posting_ids):
+        found = [by_id[posting_id] for posting_id in posting_ids if posting_id in by_id]
+        return {"postings": [posting for posting, _ in found],
+                "replies": [reply for _, replies in found for reply in replies]}
+    return export_discussions
+
+
+def test_job_archives_listed_discussions(archive_service, rpc, senders):
+    threads = [discussion(senders[0], "Job {}".format(i), "listed", datetime(2020, 1, 1)) for i in range(5)]
+    rpc.posting_service.export_discussions.side_effect = exports(*threads)
+    archive_service.chunk_size = 2
+
+    job_id = archive_service.start_archive_job([posting["posting_id"] for posting, _ in threads])
+    archive_service.dispatch.assert_called_once_with("archive_job_requested", job_id)
+    assert archive_service.get_archive_job(job_id)["status"] == "queued"
+    archive_service.run_archive_job(job_id)
+
+    job = archive_service.get_archive_job(job_id)
+    assert (job["status"], job["total"], job["archived"]) == ("finished", 5, 5)
+    assert rpc.posting_service.export_discussions.call_count == 3
+    assert len(archive_service.search_archive("listed", None, None, None)["result"]) == 5
+
+
+def test_job_walks_terminated_discussions_in_chunks(archive_service, rpc, senders):
+    threads = [discussion(senders[0], "Old {}".format(i), "terminated", datetime(2020, 1, 1)) for i in range(3)]
+    ids = [posting["posting_id"] for posting, _ in threads]
+    rpc.posting_service.export_discussions.side_effect = exports(*threads)
+    rpc.posting_service.find_archivable.side_effect = lambda before, limit, after: \
+        [posting_id for posting_id in ids if after is None or posting_id > after][:limit]
+    archive_service.chunk_size = 2
+
+    job_id = archive_service.start_archive_job(terminated_before=datetime(2021, 1, 1).timestamp())
+    archive_service.run_archive_job(job_id)
+
+    job = archive_service.get_archive_job(job_id)
+    assert (job["status"], job["total"], job["archived"]) == ("finished", 3, 3)
+    assert [call[0][2] for call in rpc.posting_service.find_archivable.call_args_list] == [None, ids[1], ids[2]]
+
+
+def test_failed_job_keeps_the_chunks_already_archived(archive_service, rpc, senders):
+    threads = [discussion(senders[0], "Fail {}".format(i), "failing", datetime(2020, 1, 1)) for i in range(4)]
+    export_discussions = exports(*threads)
+    rpc.posting_service.export_discussions.side_effect = [export_discussions([threads[0][0]["posting_id"]]),
+                                                          export_discussions([threads[1][0]["posting_id"]])]
+    rpc.posting_service.purge_discussions.side_effect = [1, IOError("posting service went away")]
+    archive_service.chunk_size = 1
+
+    job_id = archive_service.start_archive_job([posting["posting_id"] for posting, _ in threads])
+    archive_service.run_archive_job(job_id)
+    archive_service.run_archive_job(job_id)
+
+    job = archive_service.get_archive_job(job_id)
+    assert (job["status"], job["archived"]) == ("failed", 1)
+    assert "posting service went away" in job["error"]
+    assert rpc.posting_service.export_discussions.call_count == 2
+
+
+def test_job_needs_postings_or_a_cutoff(archive_service):
+    assert archive_service.start_archive_job() is None
+    assert archive_service.get_archive_job("unknown") is None
@@ -0,0 +1,67 @@
+# coding=utf-8
+from unittest import mock
+
+import pytest
+
+from common import cache
+from common.cache import TTLCache
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with mock.patch.object(cache, "time", lambda: now[0]):
+        yield now
+
+
+def test_get_and_set():
+    entries = TTLCache(10, 60)
+    entries.set("a", 1)
+
+    assert entries.get("a") == 1
+    assert entries.get("b") is None
+    assert entries.get("b", "default") == "default"
+
+
+def test_entries_expire(clock):
+    entries = TTLCache(10, 60)
+    entries.set("a", 1)
+
+    clock[0] += 59
+    assert entries.get("a") == 1
+    clock[0] += 1
+    assert entries.get("a") is None
+    assert len(entries) == 0
+
+
+def test_setting_again_restarts_the_ttl(clock):
+    entries = TTLCache(10, 60)
+    entries.set("a", 1)
+    clock[0] += 30
+    entries.set("a", 2)
+    clock[0] += 45
+
+    assert entries.get("a") == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    entries = TTLCache(2, 60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+
+    assert entries.get("a") == 1
+    assert entries.get("b") is None
+    assert entries.get("c") == 3
+
+
+def test_pop_and_clear():
+    entries = TTLCache(10, 60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+
+    assert entries.pop("a") == 1
+    assert entries.pop("a") is None
+    entries.clear()
+    assert entries.get("b") is None
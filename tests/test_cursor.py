@@ -0,0 +1,33 @@
+# coding=utf-8
+from datetime import datetime
+
+import pytest
+
+from common.cursor import encode_cursor, decode_cursor, encode_key, decode_key
+
+
+def test_cursor_round_trip():
+    position = (datetime(2020, 4, 23, 4, 19, 43, 186757), "p2020042319aea79")
+
+    assert decode_cursor(encode_cursor(*position)) == position
+
+
+def test_key_round_trip():
+    assert decode_key(encode_key(1, "ana", "u1"), 3) == [1, "ana", "u1"]
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(datetime(2020, 1, 1), "id/with+odd?chars")
+
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize("cursor", [None, 5, "", "not base64!", encode_key(1, 2, 3), encode_key("yesterday", "p1"),
+                                    encode_key(None, "p1")])
+def test_bad_cursors_decode_to_none(cursor):
+    assert decode_cursor(cursor) is None
+
+
+def test_key_size_is_checked():
+    assert decode_key(encode_key(1, 2), 3) is None
+    assert decode_key(encode_key(1, 2), 2) == [1, 2]
@@ -0,0 +1,156 @@
+# coding=utf-8
+import logging
+import os
+import sys
+from unittest import mock
+
+import pytest
+from nameko.testing.services import worker_factory
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from common import db
+from common.db import DbSession, apply_pragmas
+from service.event import Event
+from service import user
+from service.user import UserService, User
+
+
+@pytest.fixture
+def engine(db_dir):
+    # one connection and no overflow: a session that is not closed blocks the next worker
+    engine = create_engine("sqlite:///" + os.path.join(db_dir, "event.db"), poolclass=QueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.1)
+    event.listen(engine, "connect", apply_pragmas)
+    yield engine
+    engine.dispose()
+
+
+def run_worker(provider, work):
+    """Drives the provider through one worker's lifecycle the way the nameko container does."""
+    worker_ctx = mock.Mock()
+    session = provider.get_dependency(worker_ctx)
+    try:
+        work(session)
+    except Exception:
+        provider.worker_result(worker_ctx, exc_info=sys.exc_info())
+        raise
+    else:
+        provider.worker_result(worker_ctx, result=None)
+    finally:
+        provider.worker_teardown(worker_ctx)
+
+
+def add_event(event_id):
+    def work(session):
+        session.add(Event(event_id=event_id, event_type="test"))
+        session.flush()
+    return work
+
+
+def stored(engine, event_id):
+    with engine.connect() as conn:
+        return conn.execute("SELECT count(*) FROM events WHERE event_id = ?", event_id).scalar() == 1
+
+
+def test_session_is_committed_when_the_worker_succeeds(engine):
+    provider = DbSession(sessionmaker(bind=engine))
+
+    run_worker(provider, add_event("ok"))
+
+    assert stored(engine, "ok")
+    assert engine.pool.checkedout() == 0
+    assert provider.sessions == {}
+
+
+def test_session_is_rolled_back_when_the_worker_fails(engine):
+    provider = DbSession(sessionmaker(bind=engine))
+
+    def fail(session):
+        add_event("failed")(session)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        run_worker(provider, fail)
+
+    assert not stored(engine, "failed")
+    assert engine.pool.checkedout() == 0
+
+
+def test_each_worker_gets_its_own_session(engine):
+    provider = DbSession(sessionmaker(bind=engine))
+    first, second = mock.Mock(), mock.Mock()
+
+    assert provider.get_dependency(first) is not provider.get_dependency(second)
+    provider.worker_teardown(first)
+    provider.worker_teardown(second)
+
+
+def test_early_returns_do_not_keep_connections(db_dir):
+    engine = create_engine("sqlite:///" + os.path.join(db_dir, "user.db"), poolclass=QueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.1)
+    session_factory = sessionmaker(bind=engine)
+    provider = DbSession(session_factory)
+    taken = {"username": None}
+
+    def register(session):
+        service = worker_factory(UserService, querySession=session)
+        taken["username"] = taken["username"] or session.query(User.user_name).first()[0]
+        assert service.user_register(taken) == (10002, "Username has already been taken")
+        assert service.validate_login_code("000000", "no such token", 0)[1] == "Wrong token"
+        assert service.user_logout("no such token") is False
+
+    # more workers than the pool has connections: each must hand its connection back, including
+    # any session the service might open besides the worker's own
+    with mock.patch.object(user, "Session", session_factory):
+        for _ in range(3):
+            run_worker(provider, register)
+    assert engine.pool.checkedout() == 0
+    engine.dispose()
+
+
+def test_db_path_defaults_to_db_dir(monkeypatch):
+    monkeypatch.delenv("POSTING_DB", raising=False)
+    monkeypatch.setattr(db, "DB_DIR", "/data")
+
+    assert db.db_path("posting.db") == os.path.join("/data", "posting.db")
+
+
+def test_db_path_honours_per_database_override(monkeypatch):
+    monkeypatch.setenv("POSTING_DB", "/elsewhere/p.db")
+
+    assert db.db_path("posting.db") == "/elsewhere/p.db"
+    assert db.db_path("event.db") != "/elsewhere/p.db"
+
+
+def test_every_new_connection_gets_the_pragmas(db_dir, monkeypatch):
+    monkeypatch.setenv("EVENT_DB", os.path.join(db_dir, "event.db"))
+    engine = db.make_engine("event.db")
+    try:
+        settings = db.effective_settings(engine)
+    finally:
+        engine.dispose()
+
+    assert settings == {"journal_mode": "wal", "synchronous": 1, "busy_timeout": 5000, "cache_size": -65536,
+                        "mmap_size": 268435456}
+
+
+def test_setup_warns_when_workers_outnumber_connections(engine, caplog):
+    provider = DbSession(sessionmaker(bind=engine))
+    provider.container = mock.Mock(service_name="event_service", max_workers=db.POOL_SIZE + 1)
+
+    with caplog.at_level(logging.WARNING, logger="common.db"):
+        provider.setup()
+
+    assert "set MAX_WORKERS={}".format(db.POOL_SIZE + 1) in caplog.text
+
+
+def test_setup_is_quiet_when_the_pool_is_large_enough(engine, caplog):
+    provider = DbSession(sessionmaker(bind=engine))
+    provider.container = mock.Mock(service_name="event_service", max_workers=db.POOL_SIZE)
+
+    with caplog.at_level(logging.WARNING, logger="common.db"):
+        provider.setup()
+
+    assert caplog.records == []
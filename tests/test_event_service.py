@@ -0,0 +1,81 @@
+# coding=utf-8
+import pytest
+from nameko.testing.services import worker_factory
+
+from service.event import EventService, Event
+
+
+@pytest.fixture
+def event_service(make_session, rpc):
+    return worker_factory(EventService, querySession=make_session("event.db"))
+
+
+def person(user_type, first_name="Ada", last_name="Lovelace"):
+    return {"user_type": user_type, "first_name": first_name, "last_name": last_name}
+
+
+def register(service, user_id, hospital_id):
+    return service.add_event("register", user_id, target=user_id, additional_info=hospital_id)
+
+
+def checks(service, event_id):
+    event = service.querySession.query(Event).filter(Event.event_id == event_id).one()
+    return event.is_valid, event.name_match, event.physician_exist, event.verified_time is not None
+
+
+def test_new_registrations_are_listed_as_unverified(event_service):
+    register(event_service, "u1", "H1")
+
+    pending, = event_service.get_register_list()
+
+    assert (pending["target"], pending["verified"], pending["is_valid"]) == ("u1", False, None)
+
+
+def test_verification_stores_the_hospital_checks(event_service, rpc):
+    patient = register(event_service, "u1", "H1")
+    nurse = register(event_service, "u2", "H2")
+    rpc.user_service.get_users_info.return_value = {"u1": person("patient"), "u2": person("nurse", "Bo", "Li")}
+    rpc.hospital_service.verify_many.return_value = [{"exists": True, "name_match": True},
+                                                     {"exists": True, "name_match": False}]
+
+    assert event_service.verify_registrations([patient, nurse]) == 2
+
+    rpc.hospital_service.verify_many.assert_called_once_with([["H1", "Ada", "Lovelace"], ["H2", "Bo", "Li"]])
+    assert checks(event_service, patient) == (True, True, True, True)
+    assert checks(event_service, nurse) == (True, False, None, True)
+    assert all(event["verified"] for event in event_service.get_register_list())
+
+
+def test_verification_skips_users_that_are_gone(event_service, rpc):
+    gone = register(event_service, "gone", "H1")
+    kept = register(event_service, "u1", "H2")
+    rpc.user_service.get_users_info.return_value = {"u1": person("patient")}
+    rpc.hospital_service.verify_many.return_value = [{"exists": False, "name_match": False}]
+
+    assert event_service.verify_registrations() == 1
+
+    assert checks(event_service, gone) == (None, None, None, False)
+    assert checks(event_service, kept) == (False, False, False, True)
+
+
+def test_without_ids_only_unverified_events_are_checked(event_service, rpc):
+    first = register(event_service, "u1", "H1")
+    rpc.user_service.get_users_info.return_value = {"u1": person("patient"), "u2": person("patient")}
+    rpc.hospital_service.verify_many.return_value = [{"exists": True, "name_match": True}]
+    event_service.verify_registrations([first])
+    register(event_service, "u2", "H2")
+
+    event_service.verify_registrations()
+
+    assert rpc.hospital_service.verify_many.call_args[0][0] == [["H2", "Ada", "Lovelace"]]
+    assert event_service.verify_registrations() == 0
+
+
+def test_registered_event_triggers_verification(event_service, rpc):
+    event_id = register(event_service, "u1", "H1")
+    rpc.user_service.get_users_info.return_value = {"u1": person("patient")}
+    rpc.hospital_service.verify_many.return_value = [{"exists": True, "name_match": True}]
+
+    event_service.on_user_registered({"event_id": event_id})
+
+    assert checks(event_service, event_id) == (True, True, True, True)
@@ -0,0 +1,33 @@
+# coding=utf-8
+from unittest import mock
+
+from common.events import EventListener
+
+
+def message(exchange, routing_key):
+    return mock.Mock(delivery_info={"exchange": exchange, "routing_key": routing_key})
+
+
+def test_messages_reach_the_subscribed_handler():
+    listener = EventListener({"AMQP_URI": "memory://"})
+    handler = mock.Mock()
+    listener.subscribe("user_service", "user_logged_out", handler)
+    received = message("user_service.events", "user_logged_out")
+
+    listener.on_message({"token": "t"}, received)
+
+    handler.assert_called_once_with({"token": "t"})
+    received.ack.assert_called_once_with()
+
+
+def test_failing_or_unknown_handlers_still_ack():
+    listener = EventListener({"AMQP_URI": "memory://"})
+    listener.subscribe("user_service", "user_logged_out", mock.Mock(side_effect=KeyError("token")))
+    failed = message("user_service.events", "user_logged_out")
+    unknown = message("user_service.events", "user_registered")
+
+    listener.on_message({}, failed)
+    listener.on_message({}, unknown)
+
+    failed.ack.assert_called_once_with()
+    unknown.ack.assert_called_once_with()
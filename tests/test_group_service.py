@@ -0,0 +1,64 @@
+# coding=utf-8
+import pytest
+from nameko.testing.services import worker_factory
+
+from common.cache import TTLCache
+from service.group import GroupService, Group, UserGroup
+
+BOTH = [{"gid": "NPA", "groupName": "Nurse, Physician, Admin"},
+        {"gid": "PPA", "groupName": "Patient, Physician, Admin"}]
+
+
+@pytest.fixture
+def session(make_session):
+    return make_session("user.db")
+
+
+@pytest.fixture
+def group_service(session, rpc):
+    service = worker_factory(GroupService, querySession=session)
+    # the class-level cache is shared by every worker; give each test its own
+    service.user_groups = TTLCache(10, 60)
+    return service
+
+
+def test_groups_come_with_their_names(group_service):
+    assert group_service.get_group_by_user_id("d173c1a783c6408ca739252abe7d4855") == BOTH
+
+
+def test_user_without_groups(group_service):
+    assert group_service.get_group_by_user_id("nobody") == []
+
+
+def test_groups_are_cached(group_service, session):
+    user_id = "d173c1a783c6408ca739252abe7d4855"
+    group_service.get_group_by_user_id(user_id)
+    session.query(Group).filter(Group.group_id == "NPA").update({"group_name": "Renamed"})
+    session.query(UserGroup).filter(UserGroup.user_id == user_id, UserGroup.group_id == "PPA").delete()
+
+    assert group_service.get_group_by_user_id(user_id) == BOTH
+
+
+def test_changed_event_drops_the_entry(group_service, session):
+    user_id = "d173c1a783c6408ca739252abe7d4855"
+    group_service.get_group_by_user_id(user_id)
+    session.query(UserGroup).filter(UserGroup.user_id == user_id, UserGroup.group_id == "PPA").delete()
+
+    group_service.on_user_groups_changed(user_id)
+
+    assert group_service.get_group_by_user_id(user_id) == BOTH[:1]
+
+
+@pytest.mark.parametrize("user_type, groups", [
+    ("nurse", BOTH[:1]),
+    ("patient", BOTH[1:]),
+    ("physician", BOTH),
+])
+def test_adding_a_user_refreshes_the_cache_and_tells_the_other_instances(group_service, rpc, user_type, groups):
+    rpc.user_service.check_user_type_by_id.return_value = user_type
+    group_service.get_group_by_user_id("new")
+
+    group_service.add_user_into_group("new")
+
+    assert group_service.get_group_by_user_id("new") == groups
+    group_service.dispatch.assert_called_once_with("user_groups_changed", "new")
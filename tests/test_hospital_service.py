@@ -0,0 +1,93 @@
+# coding=utf-8
+import os
+import sqlite3
+from unittest import mock
+
+import pytest
+from nameko.testing.services import worker_factory
+
+from service import hospital
+from service.hospital import HospitalDirectory, HospitalService
+
+
+@pytest.fixture
+def path(raw_db_dir):
+    return os.path.join(raw_db_dir, "hospital.db")
+
+
+@pytest.fixture
+def clock():
+    clock = mock.Mock(now=1000.0)
+    with mock.patch.object(hospital, "time", lambda: clock.now):
+        yield clock
+
+
+@pytest.fixture
+def hospital_service(path):
+    return worker_factory(HospitalService, directory=HospitalDirectory(path).load())
+
+
+def rename(path, hospital_id, firstname):
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE users SET firstname = ? WHERE hospital_id = ?", (firstname, hospital_id))
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+
+
+def test_directory_indexes_lowercased_names(path):
+    index = HospitalDirectory(path).load()
+
+    with sqlite3.connect(path) as conn:
+        count, = conn.execute("SELECT count(*) FROM users").fetchone()
+    assert len(index) == count
+    assert index["PH4683"] == ("lisbeth", "monroe")
+    with pytest.raises(TypeError):
+        index["PH4683"] = ("someone", "else")
+
+
+def test_directory_reloads_when_the_file_changes(path, clock):
+    directory = HospitalDirectory(path, check_interval=5)
+    directory.setup()
+    directory.current()
+    rename(path, "PH4683", "Elisabeth")
+
+    clock.now += 1
+    assert directory.current()["PH4683"] == ("lisbeth", "monroe")
+
+    clock.now += 5
+    assert directory.current()["PH4683"] == ("elisabeth", "monroe")
+
+
+def test_directory_keeps_the_index_while_the_file_is_unchanged(path, clock):
+    directory = HospitalDirectory(path, check_interval=0)
+    directory.setup()
+    index = directory.current()
+
+    clock.now += 60
+    with mock.patch.object(directory, "load") as load:
+        assert directory.current() is index
+    load.assert_not_called()
+
+
+def test_name_checks_ignore_case(hospital_service):
+    assert hospital_service.check_user_name("PH4683", "LISBETH", "monroe")
+    assert not hospital_service.check_user_name("PH4683", "Lisbeth", "Stuart")
+    assert not hospital_service.check_user_name("NOPE", "Lisbeth", "Monroe")
+
+
+def test_existence_checks(hospital_service):
+    assert hospital_service.is_user_exist("PH4683")
+    assert not hospital_service.is_user_exist("NOPE")
+
+
+def test_verify_many_answers_each_check_in_order(hospital_service):
+    assert hospital_service.verify_many([
+        ["PH7946", "carla", "STUART"],
+        ["PH7946", "Carla", "Monroe"],
+        ["NOPE", "Carla", "Stuart"],
+        ["PH4683", None, None],
+    ]) == [
+        {"exists": True, "name_match": True},
+        {"exists": True, "name_match": False},
+        {"exists": False, "name_match": False},
+        {"exists": True, "name_match": False},
+    ]
@@ -0,0 +1,144 @@
+# coding=utf-8
+import os
+import socket
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from common import ids
+from common.ids import IdGenerator, ALPHABET, WORKER_BITS, SEQUENCE_BITS
+
+
+@pytest.fixture
+def clock():
+    """Seconds returned by ids.time; tests move it by assigning clock.now."""
+    clock = mock.Mock(now=1700000000.0)
+    with mock.patch.object(ids, "time", lambda: clock.now):
+        yield clock
+
+
+def decode(value):
+    number = 0
+    for char in value:
+        number = number * 32 + ALPHABET.index(char)
+    return number >> (WORKER_BITS + SEQUENCE_BITS), \
+        (number >> SEQUENCE_BITS) & ((1 << WORKER_BITS) - 1), \
+        number & ((1 << SEQUENCE_BITS) - 1)
+
+
+def test_ids_are_unique_and_increasing():
+    generator = IdGenerator(1)
+    values = [generator.new_id() for _ in range(10000)]
+
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+
+
+def test_id_layout(clock):
+    value = IdGenerator(7).new_id("P")
+
+    assert value[0] == "P" and len(value) == 17
+    assert set(value[1:]) <= set(ALPHABET)
+    ms, worker_id, sequence = decode(value[1:])
+    assert (ms, worker_id) == (1700000000000, 7)
+    assert sequence < 1 << (SEQUENCE_BITS - 1)
+
+
+def test_workers_never_share_ids(clock):
+    first, second = IdGenerator(1), IdGenerator(2)
+
+    assert not set(first.new_id() for _ in range(100)) & set(second.new_id() for _ in range(100))
+
+
+def test_clock_going_backwards_keeps_ids_increasing(clock):
+    generator = IdGenerator(1)
+    before = generator.new_id()
+    clock.now -= 5
+
+    after = generator.new_id()
+
+    assert after > before
+    assert decode(after)[0] == decode(before)[0]
+
+
+def test_full_sequence_borrows_the_next_millisecond(clock):
+    generator = IdGenerator(1)
+    generator.new_id()
+    generator._sequence = (1 << SEQUENCE_BITS) - 1
+
+    ms, _, sequence = decode(generator.new_id())
+
+    assert (ms, sequence) == (1700000000001, 0)
+
+
+@pytest.mark.parametrize("worker_id", [-1, 1 << WORKER_BITS])
+def test_worker_id_out_of_range(worker_id):
+    with pytest.raises(ValueError):
+        IdGenerator(worker_id)
+
+
+@pytest.fixture
+def registry(db_dir, monkeypatch):
+    monkeypatch.delenv("WORKER_ID")
+    monkeypatch.setenv("IDS_DB", os.path.join(db_dir, "ids.db"))
+    with mock.patch.object(ids.atexit, "register"):
+        yield os.path.join(db_dir, "ids.db")
+
+
+def claims(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT worker_id, host, pid FROM worker_claim ORDER BY worker_id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_worker_id_from_the_environment(registry, monkeypatch):
+    monkeypatch.setenv("WORKER_ID", "42")
+
+    assert decode(ids.new_id())[1] == 42
+    assert claims(registry) == []
+
+
+def test_worker_id_is_claimed_once_per_process(registry):
+    first, second = ids.new_id(), ids.new_id()
+
+    assert decode(first)[1] == decode(second)[1] == 0
+    assert claims(registry) == [(0, socket.gethostname(), os.getpid())]
+
+
+def test_running_processes_get_distinct_worker_ids(registry):
+    with mock.patch.object(ids.os, "getpid", return_value=1):
+        assert ids.claim_worker_id(registry) == 0
+    # another host's claim is held whatever its pid
+    conn = sqlite3.connect(registry)
+    with conn:
+        conn.execute("INSERT INTO worker_claim (worker_id, host, pid) VALUES (1, 'elsewhere', 999999999)")
+    conn.close()
+
+    assert ids.claim_worker_id(registry) == 2
+
+
+def test_claims_of_dead_processes_are_reused(registry):
+    conn = sqlite3.connect(registry)
+    with conn:
+        conn.execute("INSERT INTO worker_claim (worker_id, host, pid) VALUES (0, ?, 999999999)",
+                     (socket.gethostname(),))
+    conn.close()
+
+    assert ids.claim_worker_id(registry) == 0
+    assert claims(registry) == [(0, socket.gethostname(), os.getpid())]
+
+
+def test_claim_is_released(registry):
+    worker_id = ids.claim_worker_id(registry)
+
+    ids.release_worker_id(registry, worker_id, socket.gethostname(), os.getpid())
+
+    assert claims(registry) == []
+
+
+def test_missing_registry_refuses_to_start(registry, tmp_path):
+    with pytest.raises(RuntimeError):
+        ids.claim_worker_id(str(tmp_path / "missing" / "ids.db"))
@@ -0,0 +1,73 @@
+# coding=utf-8
+import random
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from service.dict import KeywordMatcher, KeywordIndex, KeywordService
+
+
+def test_overlapping_keywords():
+    matcher = KeywordMatcher(["he", "she", "his", "hers"])
+
+    assert sorted(matcher.iter_matches("ushers")) == ["he", "hers", "she"]
+    assert matcher.search("ahishers") == ["his", "she", "he", "hers"]
+
+
+def test_matching_ignores_case():
+    matcher = KeywordMatcher(["Spam"])
+
+    assert matcher.contains_any("buy SPAM now")
+    assert matcher.search("sPaM") == ["spam"]
+
+
+def test_topic_and_missing_texts():
+    matcher = KeywordMatcher(["scam"])
+
+    assert matcher.contains_any("hello", "this is a scam")
+    assert not matcher.contains_any("hello", None)
+    assert not matcher.contains_any("")
+
+
+def test_no_keywords():
+    matcher = KeywordMatcher(["", None])
+
+    assert not matcher.contains_any("anything")
+    assert matcher.search("anything") == []
+
+
+def test_agrees_with_substring_search():
+    rng = random.Random(7)
+    keywords = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(20)]
+    matcher = KeywordMatcher(keywords)
+    for _ in range(200):
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 12)))
+        assert set(matcher.search(text)) == set(k for k in keywords if k in text)
+
+
+@pytest.fixture
+def keyword_service(make_service, make_session):
+    index = KeywordIndex(sessionmaker(bind=make_session("dict.db").bind))
+    index.setup()
+    return make_service(KeywordService, "dict.db", keywords=index)
+
+
+def test_index_follows_keyword_changes(keyword_service):
+    assert not keyword_service.check_discussion_posting("a brand new phrase")
+
+    assert keyword_service.add_a_keyword("Brand New")
+    assert not keyword_service.add_a_keyword("brand new")
+    assert keyword_service.check_discussion_posting("a brand new phrase")
+    assert keyword_service.match_keywords("a BRAND NEW phrase") == ["brand new"]
+    keyword_service.dispatch.assert_called_with("keywords_changed", "brand new")
+
+    assert keyword_service.remove_a_keyword("brand new")
+    assert not keyword_service.remove_a_keyword("brand new")
+    assert not keyword_service.check_discussion_posting("a brand new phrase")
+
+
+def test_index_is_loaded_from_the_database(keyword_service):
+    keywords = keyword_service.get_all_keywords()
+
+    assert keywords
+    assert all(keyword_service.check_discussion_posting("xx " + keyword + " xx") for keyword in keywords)
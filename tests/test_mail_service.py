@@ -0,0 +1,153 @@
+# coding=utf-8
+import smtplib
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+from nameko.testing.services import worker_factory
+
+from service import mail
+from service.mail import MailService, OutboxMail
+
+
+class FakeBackend(object):
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.sent = []
+        self.opened = 0
+        self.closed = 0
+        self.connected = False
+
+    def open(self):
+        if not self.connected:
+            self.opened += 1
+            self.connected = True
+
+    def send(self, to, subject, content):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append(to)
+
+    def close(self):
+        self.closed += 1
+        self.connected = False
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(MailService, "backend", backend)
+    return backend
+
+
+@pytest.fixture
+def mail_service(make_session, backend):
+    return worker_factory(MailService, querySession=make_session("mail.db"))
+
+
+def outbox(service, mail_id):
+    service.querySession.expire_all()
+    return service.querySession.query(OutboxMail).get(mail_id)
+
+
+def test_mail_is_queued_then_sent_over_one_connection(mail_service, backend):
+    mail_ids = [mail_service.send_mail("{}@example.com".format(i), "hi", "<b>hi</b>") for i in range(3)]
+    assert outbox(mail_service, mail_ids[0]).status == "pending"
+
+    assert mail_service.send_batch() == 3
+
+    assert backend.sent == ["0@example.com", "1@example.com", "2@example.com"]
+    assert backend.opened == 1
+    for mail_id in mail_ids:
+        sent = outbox(mail_service, mail_id)
+        assert (sent.status, sent.claim, sent.error) == ("sent", None, None)
+    assert mail_service.send_batch() == 0
+
+
+def test_mail_requested_event_is_queued(mail_service):
+    mail_service.on_mail_requested({"to": "a@example.com", "subject": "s", "content": "c"})
+
+    assert mail_service.querySession.query(OutboxMail).filter(OutboxMail.recipient == "a@example.com").count() == 1
+
+
+def test_mail_requested_is_handled_from_the_gateway_and_the_services():
+    sources = {entrypoint.source_service for entrypoint in MailService.on_mail_requested.nameko_entrypoints}
+
+    assert sources == {"mail_service", "posting_service", "user_service"}
+
+
+def test_failed_mail_is_retried_with_backoff(mail_service, backend):
+    backend.failures = [smtplib.SMTPRecipientsRefused({})]
+    mail_id = mail_service.send_mail("a@example.com", "s", "c")
+
+    mail_service.send_batch()
+
+    failed = outbox(mail_service, mail_id)
+    assert (failed.status, failed.attempts, failed.claim) == ("pending", 1, None)
+    assert "SMTPRecipientsRefused" in failed.error
+    assert failed.next_attempt > datetime.now() + timedelta(seconds=mail.RETRY_BACKOFF - 5)
+    assert backend.closed == 1
+    assert mail_service.send_batch() == 0
+
+    failed.next_attempt = datetime.now()
+    mail_service.querySession.commit()
+    assert mail_service.send_batch() == 1
+    assert outbox(mail_service, mail_id).status == "sent"
+
+
+def test_mail_fails_for_good_after_max_attempts(mail_service, backend, monkeypatch):
+    monkeypatch.setattr(mail, "MAX_ATTEMPTS", 2)
+    backend.failures = [IOError("down"), IOError("still down")]
+    mail_id = mail_service.send_mail("a@example.com", "s", "c")
+
+    mail_service.send_batch()
+    outbox(mail_service, mail_id).next_attempt = datetime.now()
+    mail_service.querySession.commit()
+    mail_service.send_batch()
+
+    assert (outbox(mail_service, mail_id).status, outbox(mail_service, mail_id).attempts) == ("failed", 2)
+
+
+def test_claims_of_a_crashed_worker_expire(mail_service, backend):
+    mail_id = mail_service.send_mail("a@example.com", "s", "c")
+    claimed = outbox(mail_service, mail_id)
+    claimed.status, claimed.claim = "sending", "crashed-worker"
+    claimed.next_attempt = datetime.now() + timedelta(seconds=mail.CLAIM_TIMEOUT)
+    mail_service.querySession.commit()
+
+    assert mail_service.send_batch() == 0
+
+    claimed.next_attempt = datetime.now() - timedelta(seconds=1)
+    mail_service.querySession.commit()
+    assert mail_service.send_batch() == 1
+    assert outbox(mail_service, mail_id).status == "sent"
+
+
+def test_batches_are_capped(mail_service, monkeypatch):
+    monkeypatch.setattr(mail, "BATCH_SIZE", 2)
+    for i in range(5):
+        mail_service.send_mail("{}@example.com".format(i), "s", "c")
+
+    assert [mail_service.send_batch() for _ in range(4)] == [2, 2, 1, 0]
+
+
+def test_dropped_connection_is_reopened(mail_service, backend):
+    backend.failures = [smtplib.SMTPServerDisconnected()]
+    mail_service.send_mail("a@example.com", "s", "c")
+
+    mail_service.send_batch()
+
+    assert backend.sent == ["a@example.com"]
+    assert backend.opened == 2
+
+
+def test_smtp_backend_builds_a_mime_message():
+    backend = mail.SmtpBackend()
+    backend.smtp = mock.Mock()
+
+    backend.send("a@example.com", "Subject", "<b>body</b>")
+
+    sender, recipients, message = backend.smtp.sendmail.call_args[0]
+    assert recipients == ["a@example.com"]
+    assert "Subject: Subject" in message and "text/html" in message
@@ -0,0 +1,221 @@
+# coding=utf-8
+import os
+import sqlite3
+from unittest import mock
+
+import pytest
+
+from common import migrate
+from common.archive_format import unpack_thread
+
+
+def version(db_dir, db_name):
+    with sqlite3.connect(os.path.join(db_dir, db_name)) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def indexes(db_dir, db_name):
+    with sqlite3.connect(os.path.join(db_dir, db_name)) as conn:
+        return set(name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+
+
+def test_upgrade_reaches_the_last_step(raw_db_dir):
+    for db_name, steps in migrate.MIGRATIONS.items():
+        assert migrate.upgrade(db_name, raw_db_dir, log=lambda message: None) == steps[-1][0]
+        assert version(raw_db_dir, db_name) == steps[-1][0]
+
+    assert {"ix_posting_type_time", "ix_posting_group_type_time"} <= indexes(raw_db_dir, "posting.db")
+    assert "ix_events_type_status" in indexes(raw_db_dir, "event.db")
+
+
+def test_upgrade_applies_each_step_once(db_dir):
+    log = mock.Mock()
+    for db_name in migrate.MIGRATIONS:
+        migrate.upgrade(db_name, db_dir, log=log)
+
+    log.assert_not_called()
+
+
+def test_failed_step_is_rolled_back(raw_db_dir):
+    steps = {"event.db": [
+        (1, "good", ["CREATE INDEX ix_test_target ON events (target)"]),
+        (2, "bad", ["CREATE INDEX ix_test_status ON events (event_status)", "CREATE INDEX ix_broken ON nothing (x)"]),
+    ]}
+    with mock.patch.dict(migrate.MIGRATIONS, steps):
+        with pytest.raises(sqlite3.OperationalError):
+            migrate.upgrade("event.db", raw_db_dir, log=lambda message: None)
+
+    assert version(raw_db_dir, "event.db") == 1
+    assert "ix_test_target" in indexes(raw_db_dir, "event.db")
+    assert "ix_test_status" not in indexes(raw_db_dir, "event.db")
+
+
+@pytest.mark.parametrize("db_name", sorted(migrate.CREATED_DATABASES))
+def test_main_creates_missing_databases(raw_db_dir, db_name):
+    assert migrate.main(["--db-dir", raw_db_dir]) == 0
+
+    assert version(raw_db_dir, db_name) == migrate.MIGRATIONS[db_name][-1][0]
+
+
+def test_check_passes_on_migrated_databases(db_dir, capsys):
+    assert migrate.main(["--check", "--db-dir", db_dir]) == 0
+    assert "fails" not in capsys.readouterr().out
+
+
+def test_check_fails_before_migrating(raw_db_dir, capsys):
+    assert migrate.main(["--check", "--db-dir", raw_db_dir]) == 1
+    assert "posting.db: get_discussions fails the plan check" in capsys.readouterr().out
+
+
+def test_check_fails_without_an_index(db_dir, capsys):
+    with sqlite3.connect(os.path.join(db_dir, "posting.db")) as conn:
+        conn.execute("DROP INDEX ix_reply_discussion_time_id")
+
+    assert migrate.main(["--check", "--db-dir", db_dir]) == 1
+    assert "get_replies fails the plan check" in capsys.readouterr().out
+
+
+def test_every_hot_query_is_planned(db_dir):
+    for db_name in migrate.QUERY_SOURCES:
+        conn = migrate.connect(db_name, db_dir)
+        try:
+            for name, query, *_ in migrate.hot_queries(db_name):
+                assert migrate.query_plan(conn, query), name
+        finally:
+            conn.close()
+
+
+@pytest.mark.parametrize("plan, scans", [
+    (["SEARCH posting USING INDEX ix_posting_type_time (posting_type=?)"], []),
+    (["SCAN posting"], ["SCAN posting"]),
+    (["SCAN TABLE posting"], ["SCAN TABLE posting"]),
+    (["SCAN posting USING INDEX ix_posting_type_time"], ["SCAN posting USING INDEX ix_posting_type_time"]),
+    (["SCAN posting_fts VIRTUAL TABLE INDEX 0:M2"], []),
+    (["SCAN posting_fts VIRTUAL TABLE INDEX 0:"], ["SCAN posting_fts VIRTUAL TABLE INDEX 0:"]),
+    (["CO-ROUTINE ranked", "SEARCH reply USING INDEX ix_reply_discussion_time (discussion_id=?)", "SCAN ranked"],
+     []),
+    (["MATERIALIZE matched", "SCAN matched", "SCAN (subquery-1)", "SCAN CONSTANT ROW"], []),
+])
+def test_plan_scans(plan, scans):
+    assert migrate.plan_scans(plan) == scans
+
+
+def test_index_walk_can_be_allowed():
+    assert migrate.plan_scans(["SCAN posting USING INDEX ix_posting_type_time"], allow_index_walk=True) == []
+
+
+def test_termination_time_is_backfilled(raw_db_dir):
+    path = os.path.join(raw_db_dir, "posting.db")
+    with sqlite3.connect(path) as conn:
+        with_replies, without_replies = conn.execute(
+            "SELECT posting_id FROM posting WHERE posting_type = 'discussion' ORDER BY posting_id LIMIT 2").fetchall()
+        conn.execute("UPDATE posting SET posting_status = 'terminated' WHERE posting_id IN (?, ?)",
+                     with_replies + without_replies)
+        conn.execute("DELETE FROM reply WHERE discussion_id = "
+                     "(SELECT discussion_id FROM posting WHERE posting_id = ?)", without_replies)
+        last_reply = conn.execute("SELECT max(reply.posting_time) FROM reply JOIN posting "
+                                  "ON posting.discussion_id = reply.discussion_id WHERE posting.posting_id = ?",
+                                  with_replies).fetchone()[0]
+        posted = conn.execute("SELECT posting_time FROM posting WHERE posting_id = ?", without_replies).fetchone()[0]
+
+    migrate.upgrade("posting.db", raw_db_dir, log=lambda message: None)
+
+    with sqlite3.connect(path) as conn:
+        terminated = dict(conn.execute("SELECT posting_id, terminated_time FROM posting "
+                                       "WHERE terminated_time IS NOT NULL").fetchall())
+    assert last_reply is not None
+    assert terminated == {with_replies[0]: last_reply, without_replies[0]: posted}
+
+
+def test_archived_rows_are_packed_into_threads(raw_db_dir):
+    path = os.path.join(raw_db_dir, "archive.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO archived_posting VALUES ('p1', 'u1', '2020-01-01 10:00:00.000000', 'Old topic', "
+                     "'old message', 'PPA', 'd1')")
+        conn.executemany("INSERT INTO archived_reply VALUES (?, 'd1', 'u2', ?, ?)", [
+            ("r2", "2020-01-01 12:00:00.000000", "second"), ("r1", "2020-01-01 11:00:00.000000", "first archived")])
+
+    migrate.upgrade("archive.db", raw_db_dir, log=lambda message: None)
+
+    with sqlite3.connect(path) as conn:
+        (thread_id, discussion_id, reply_count, payload), = conn.execute(
+            "SELECT thread_id, discussion_id, reply_count, payload FROM archived_thread").fetchall()
+        matches = conn.execute("SELECT rowid FROM archive_fts WHERE archive_fts MATCH 'archived'").fetchall()
+        tables = set(name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    record = unpack_thread(payload)
+    assert (discussion_id, reply_count) == ("d1", 2)
+    assert [r["message"] for r in record["replies"]] == ["first archived", "second"]
+    assert matches == [(thread_id,)]
+    assert not {"archived_posting", "archived_reply"} & tables
+
+
+def test_rollup_is_filled_from_existing_rows(db_dir):
+    with sqlite3.connect(os.path.join(db_dir, "posting.db")) as conn:
+        rollup = dict(((sender, kind), n) for sender, kind, n in conn.execute(
+            "SELECT sender, kind, sum(n) FROM posting_rollup GROUP BY sender, kind HAVING sum(n) > 0"))
+        raw = dict(((sender, kind), n) for sender, kind, n in conn.execute(
+            "SELECT sender, posting_type, count(*) FROM posting WHERE posting_type = 'dissemination' "
+            "OR posting_status = 'open' GROUP BY 1, 2 "
+            "UNION ALL SELECT sender, 'reply', count(*) FROM reply GROUP BY 1"))
+
+    assert raw
+    assert rollup == raw
+
+
+def test_moderation_queue_is_filled_from_pending_events(raw_db_dir):
+    with sqlite3.connect(os.path.join(raw_db_dir, "user.db")) as conn:
+        (patient, patient_name, patient_email), (physician, physician_name, physician_email) = conn.execute(
+            "SELECT user_id, user_name, user_email FROM users ORDER BY user_id LIMIT 2").fetchall()
+    with sqlite3.connect(os.path.join(raw_db_dir, "event.db")) as conn:
+        conn.executemany("INSERT INTO events (event_id, event_type, event_status) VALUES (?, ?, ?)", [
+            ("e1", "posting", "processing"), ("e2", "private_request", "processing"),
+            ("e3", "posting", "approved")])
+    with sqlite3.connect(os.path.join(raw_db_dir, "posting.db")) as conn:
+        conn.executemany("INSERT INTO posting (posting_id, sender, posting_time, posting_type, posting_topic, "
+                         "message, group_id, discussion_id, posting_status, event_id) "
+                         "VALUES (?, ?, '2020-01-01 10:00:00.000000', 'discussion', 'topic', ?, 'PPA', ?, "
+                         "'processing', ?)", [
+                             ("p1", patient, "pending", "d1", "e1"),
+                             ("p3", patient, "stale", "d3", "e3")])
+        conn.execute("INSERT INTO private_conversation (conversation_id, event_id, patient_id, physician_id, "
+                     "password, topic, message, status, posting_time) VALUES ('c2', 'e2', ?, ?, 'X', 'private', "
+                     "'please', 'processing', '2020-01-01 11:00:00.000000')", (patient, physician))
+
+    migrate.upgrade("posting.db", raw_db_dir, log=lambda message: None)
+
+    with sqlite3.connect(os.path.join(raw_db_dir, "posting.db")) as conn:
+        queue = conn.execute("SELECT event_id, item_type, item_id, sender_name, sender_email, physician_name, "
+                             "physician_email, message FROM moderation_queue ORDER BY request_time").fetchall()
+    assert queue == [
+        ("e1", "posting", "p1", patient_name, patient_email, None, None, "pending"),
+        ("e2", "private_request", "c2", patient_name, patient_email, physician_name, physician_email, "please"),
+    ]
+
+
+def test_pending_registrations_are_verified(raw_db_dir):
+    with sqlite3.connect(os.path.join(raw_db_dir, "user.db")) as conn:
+        physician, = conn.execute("SELECT user_id FROM users WHERE user_firstname = 'Lisbeth' "
+                                  "AND user_lastname = 'Monroe'").fetchone()
+    with sqlite3.connect(os.path.join(raw_db_dir, "event.db")) as conn:
+        conn.executemany("INSERT INTO events (event_id, event_type, target, event_status, additional_info) "
+                         "VALUES (?, 'register', ?, ?, ?)", [
+                             ("e1", physician, "processing", "PH4683"),
+                             ("e2", physician, "processing", "PH7946"),
+                             ("e3", physician, "processing", "NOPE"),
+                             ("e4", "gone", "processing", "PH4683"),
+                             ("e5", physician, "approved", "PH4683")])
+
+    migrate.upgrade("event.db", raw_db_dir, log=lambda message: None)
+
+    with sqlite3.connect(os.path.join(raw_db_dir, "event.db")) as conn:
+        checks = dict((event_id, (is_valid, name_match, physician_exist, verified is not None))
+                      for event_id, is_valid, name_match, physician_exist, verified in conn.execute(
+                          "SELECT event_id, is_valid, name_match, physician_exist, verified_time FROM events "
+                          "WHERE event_type = 'register'"))
+    assert checks == {
+        "e1": (1, 1, None, True),
+        "e2": (1, 0, None, True),
+        "e3": (0, 0, None, True),
+        "e4": (None, None, None, False),
+        "e5": (None, None, None, False),
+    }
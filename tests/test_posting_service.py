@@ -0,0 +1,428 @@
+# coding=utf-8
+from datetime import datetime, timedelta
+from itertools import count
+
+import pytest
+
+from common.fts import make_match_query
+from service.posting import PostingService, Posting, Reply
+from service.user import User
+
+_ids = count()
+
+
+@pytest.fixture
+def posting_service(make_service, rpc, user_service):
+    rpc.user_service.get_users_info.side_effect = user_service.get_users_info
+    return make_service(PostingService, "posting.db")
+
+
+@pytest.fixture
+def sender(user_service):
+    return user_service.querySession.query(User.user_id).first()[0]
+
+
+def add_discussion(service, sender, message, topic="topic", group_id="PPA", when=None, status="open"):
+    number = next(_ids)
+    posting = Posting(posting_id="ptest{:04d}".format(number), sender=sender, posting_type="discussion",
+                      posting_time=when or datetime.now(), posting_topic=topic, message=message,
+                      group_id=group_id, discussion_id="dtest{:04d}".format(number), posting_status=status)
+    service.querySession.add(posting)
+    service.querySession.commit()
+    return posting
+
+
+def add_reply(service, discussion, sender, message, when):
+    reply = Reply(posting_id="rtest{:04d}".format(next(_ids)), discussion_id=discussion.discussion_id,
+                  sender=sender, posting_time=when, message=message)
+    service.querySession.add(reply)
+    service.querySession.commit()
+    return reply
+
+
+def test_list_builders_resolve_senders_in_one_call(posting_service, rpc):
+    discussions = posting_service.get_discussions("PPA")
+    senders = set(posting.sender for posting in
+                  posting_service.querySession.query(Posting).filter(Posting.group_id == "PPA",
+                                                                     Posting.posting_type == "discussion"))
+
+    assert len(discussions) > 1
+    rpc.user_service.get_users_info.assert_called_once()
+    assert sorted(rpc.user_service.get_users_info.call_args[0][0]) == sorted(senders)
+    assert all(posting["senderName"] for posting in discussions)
+
+
+def test_reply_builder_resolves_senders_in_one_call(posting_service, rpc):
+    discussion_id = posting_service.get_discussions("PPA")[0]["discussion_id"]
+    rpc.user_service.get_users_info.reset_mock()
+
+    replies = posting_service.get_replies(discussion_id)
+
+    assert replies
+    assert rpc.user_service.get_users_info.call_count == 1
+
+
+def test_match_query_quotes_and_prefixes_terms():
+    assert make_match_query('dialysis "home') == '"dialysis"* """home"*'
+    assert make_match_query("  ") == ""
+
+
+def test_search_finds_postings_by_topic_message_and_reply(posting_service, sender):
+    by_topic = add_discussion(posting_service, sender, "nothing here", topic="Zanzibar outbreak")
+    by_message = add_discussion(posting_service, sender, "we saw a zanzibari strain")
+    by_reply = add_discussion(posting_service, sender, "unrelated")
+    add_reply(posting_service, by_reply, sender, "it came from Zanzibar", datetime.now())
+    add_discussion(posting_service, sender, "Zanzibar elsewhere", group_id="NPA")
+
+    found = posting_service.search_posting("PPA", "zanzib", None, None, None)
+
+    assert sorted(posting["postingID"] for posting in found) == \
+        sorted([by_topic.posting_id, by_message.posting_id, by_reply.posting_id])
+    assert all("<b>" in posting["snippet"] for posting in found)
+
+
+def test_search_applies_date_and_sender_filters(posting_service, sender):
+    old = add_discussion(posting_service, sender, "quokka sighting", when=datetime(2019, 1, 1))
+    new = add_discussion(posting_service, sender, "quokka again", when=datetime(2021, 1, 1))
+
+    found = posting_service.search_posting("PPA", "quokka", datetime(2020, 1, 1).timestamp(), None, sender)
+    assert [posting["postingID"] for posting in found] == [new.posting_id]
+    assert posting_service.search_posting("PPA", "quokka", None, None, "someone else") == []
+    assert len(posting_service.search_posting("PPA", "quokka", None, None, None)) == 2
+    assert old.posting_id in [p["postingID"] for p in posting_service.search_posting("PPA", "", None, None, None)]
+
+
+def test_index_follows_edits_and_deletes(posting_service, sender):
+    posting = add_discussion(posting_service, sender, "wombat census")
+    posting.message = "echidna census"
+    posting_service.querySession.commit()
+
+    assert posting_service.search_posting("PPA", "wombat", None, None, None) == []
+    assert len(posting_service.search_posting("PPA", "echidna", None, None, None)) == 1
+
+    posting_service.remove_a_posting(posting.posting_id)
+    assert posting_service.search_posting("PPA", "echidna", None, None, None) == []
+
+
+def page_through(fetch, key, limit):
+    items = []
+    cursor = None
+    while True:
+        page = fetch(limit=limit, cursor=cursor)
+        items.extend(item["postingID"] for item in page[key])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def test_reply_pages_follow_time_then_id_order(posting_service, sender):
+    discussion = add_discussion(posting_service, sender, "paged replies")
+    start = datetime(2020, 5, 1, 12)
+    # the last four replies share a timestamp, so the page boundary has to fall between equal times
+    replies = [add_reply(posting_service, discussion, sender, "reply {}".format(i),
+                         start + timedelta(seconds=min(i, 3))) for i in range(7)]
+
+    paged = page_through(lambda **kwargs: posting_service.get_replies_page(discussion.discussion_id, **kwargs),
+                         "replies", 2)
+
+    expected = [reply.posting_id for reply in sorted(replies, key=lambda r: (r.posting_time, r.posting_id))]
+    assert paged == expected
+    assert [r["postingID"] for r in posting_service.get_replies(discussion.discussion_id, limit=10)] == expected
+
+
+def test_reply_page_rejects_a_bad_cursor(posting_service, sender):
+    discussion = add_discussion(posting_service, sender, "paged replies")
+
+    assert posting_service.get_replies_page(discussion.discussion_id, cursor="nope") is None
+    assert posting_service.get_replies_page(discussion.discussion_id) == {"replies": [], "next_cursor": None}
+
+
+def test_feed_pages_across_groups_newest_first(posting_service, sender):
+    start = datetime(2030, 1, 1)
+    added = [add_discussion(posting_service, sender, "feed {}".format(i), group_id=("PPA", "NPA")[i % 2],
+                            when=start + timedelta(minutes=i // 2)) for i in range(6)]
+    add_discussion(posting_service, sender, "awaiting moderation", when=start, status="processing")
+
+    feed = page_through(lambda **kwargs: posting_service.get_feed(["PPA", "NPA"], "discussion", **kwargs),
+                        "postings", 4)
+
+    newest = sorted(added, key=lambda p: (p.posting_time, p.posting_id), reverse=True)
+    assert feed[:6] == [posting.posting_id for posting in newest]
+    unpaged = posting_service.get_discussions("PPA") + posting_service.get_discussions("NPA")
+    assert sorted(feed) == sorted(posting["postingID"] for posting in unpaged)
+
+
+def test_feed_adds_group_names_and_rejects_bad_cursors(posting_service, sender):
+    add_discussion(posting_service, sender, "named", group_id="NPA", when=datetime(2030, 1, 1))
+
+    page = posting_service.get_feed(["NPA"], "discussion", limit=1, group_names={"NPA": "Nurses"})
+
+    assert page["postings"][0]["groupName"] == "Nurses"
+    assert page["next_cursor"]
+    assert posting_service.get_feed(["NPA"], "discussion", cursor="bad") is None
+
+
+def test_search_across_groups_embeds_first_replies(posting_service, sender, rpc):
+    start = datetime(2031, 1, 1)
+    older = add_discussion(posting_service, sender, "platypus venom", group_id="PPA", when=start)
+    newer = add_discussion(posting_service, sender, "platypus eggs", group_id="NPA", when=start + timedelta(hours=1))
+    add_discussion(posting_service, sender, "platypus elsewhere", group_id="XYZ", when=start)
+    for i in range(10):
+        add_reply(posting_service, older, sender, "answer {}".format(i), start + timedelta(minutes=i))
+    rpc.user_service.get_users_info.reset_mock()
+
+    found = posting_service.search_postings(["PPA", "NPA"], "platypus", None, None, None)
+
+    assert [posting["postingID"] for posting in found] == [newer.posting_id, older.posting_id]
+    assert "replies" not in found[0]
+    assert [reply["message"] for reply in found[1]["replies"]] == ["answer {}".format(i) for i in range(8)]
+    assert rpc.user_service.get_users_info.call_count == 2
+
+
+def test_search_across_groups_is_capped(posting_service, sender):
+    for i in range(5):
+        add_discussion(posting_service, sender, "capybara {}".format(i), when=datetime(2031, 2, 1, i))
+
+    found = posting_service.search_postings(["PPA"], "capybara", None, None, None, limit=3)
+
+    assert [posting["message"] for posting in found] == ["capybara 4", "capybara 3", "capybara 2"]
+
+
+def test_bulk_replies_are_keyed_by_discussion(posting_service, sender):
+    start = datetime(2032, 1, 1)
+    busy = add_discussion(posting_service, sender, "busy")
+    quiet = add_discussion(posting_service, sender, "quiet")
+    silent = add_discussion(posting_service, sender, "silent")
+    for i in range(4):
+        add_reply(posting_service, busy, sender, "busy {}".format(i), start + timedelta(minutes=3 - i))
+    add_reply(posting_service, quiet, sender, "quiet 0", start)
+
+    replies = posting_service.get_replies_for_discussions(
+        [busy.discussion_id, quiet.discussion_id, silent.discussion_id, busy.discussion_id, None], 3)
+
+    assert sorted(replies) == sorted([busy.discussion_id, quiet.discussion_id])
+    assert [reply["message"] for reply in replies[busy.discussion_id]] == ["busy 3", "busy 2", "busy 1"]
+    assert [reply["message"] for reply in replies[quiet.discussion_id]] == ["quiet 0"]
+    assert len(posting_service.get_replies_for_discussions([busy.discussion_id], None)[busy.discussion_id]) == 4
+
+
+def test_bulk_replies_match_per_discussion_calls(posting_service):
+    discussion_ids = [posting["discussion_id"] for posting in posting_service.get_discussions("PPA")]
+
+    replies = posting_service.get_replies_for_discussions(discussion_ids)
+
+    for discussion_id in discussion_ids:
+        assert replies.get(discussion_id, []) == posting_service.get_replies(discussion_id)
+
+
+def test_archivable_discussions_are_chosen_by_termination_time(posting_service, sender):
+    long_ago = datetime(2000, 1, 1)
+    recently_terminated = add_discussion(posting_service, sender, "old but just closed", when=long_ago)
+    posting_service.terminate_a_posting(recently_terminated.posting_id)
+    closed_long_ago = [add_discussion(posting_service, sender, "closed {}".format(i), when=long_ago,
+                                      status="terminated") for i in range(3)]
+    for posting in closed_long_ago:
+        posting.terminated_time = long_ago + timedelta(days=1)
+    add_discussion(posting_service, sender, "still open", when=long_ago)
+    posting_service.querySession.commit()
+    cutoff = (datetime.now() - timedelta(hours=1)).timestamp()
+
+    first = posting_service.find_archivable(cutoff, limit=2)
+    rest = posting_service.find_archivable(cutoff, limit=2, after=first[-1])
+
+    assert recently_terminated.terminated_time > datetime.now() - timedelta(minutes=1)
+    assert first + rest == sorted(posting.posting_id for posting in closed_long_ago)
+    assert recently_terminated.posting_id in posting_service.find_archivable(datetime.now().timestamp() + 1)
+
+
+def test_export_and_purge_terminated_discussions(posting_service, sender):
+    discussion = add_discussion(posting_service, sender, "to be archived", status="terminated")
+    add_reply(posting_service, discussion, sender, "last word", datetime(2020, 1, 1))
+    still_open = add_discussion(posting_service, sender, "open")
+
+    exported = posting_service.export_discussions([discussion.posting_id, still_open.posting_id])
+
+    assert [posting["posting_id"] for posting in exported["postings"]] == [discussion.posting_id]
+    assert [reply["message"] for reply in exported["replies"]] == ["last word"]
+    posting_id, discussion_id = discussion.posting_id, discussion.discussion_id
+    assert posting_service.purge_discussions([posting_id]) == 1
+    assert posting_service.get_replies(discussion_id) == []
+    assert posting_service.get_posting_info(posting_id) is None
+
+
+def raw_counts(service, start, end):
+    """counting_report's figures computed row by row, with both ends of the range excluded."""
+    session = service.querySession
+    counts = {}
+    for posting in session.query(Posting).filter(Posting.posting_time > start, Posting.posting_time < end):
+        if posting.posting_type == "dissemination" or posting.posting_status == "open":
+            kind = posting.posting_type
+            counts.setdefault(posting.sender, {}).setdefault(kind, 0)
+            counts[posting.sender][kind] += 1
+    for reply in session.query(Reply).filter(Reply.posting_time > start, Reply.posting_time < end):
+        counts.setdefault(reply.sender, {}).setdefault("reply", 0)
+        counts[reply.sender]["reply"] += 1
+    return counts
+
+
+def expected_info(counts, user_id):
+    return {
+        "total_dissemination": sum(user.get("dissemination", 0) for user in counts.values()),
+        "total_discussion": sum(user.get("discussion", 0) for user in counts.values()),
+        "user_dissemination": counts.get(user_id, {}).get("dissemination", 0),
+        "user_discussion": counts.get(user_id, {}).get("discussion", 0),
+        "involved_user": sum(1 for user in counts.values() if user.get("reply"))
+    }
+
+
+@pytest.fixture
+def hour_edges(posting_service, user_service):
+    """Postings and replies on, just before and just after the hour boundaries of 2033-01-01 10:00-14:00."""
+    senders = [user_id for user_id, in user_service.querySession.query(User.user_id).limit(2)]
+    base = datetime(2033, 1, 1, 10)
+    offsets = [timedelta(0), timedelta(microseconds=1), timedelta(minutes=30), timedelta(minutes=59, seconds=59)]
+    moments = [base + timedelta(hours=h) + offset for h in range(5) for offset in offsets]
+    for i, when in enumerate(moments):
+        sender = senders[i % 2]
+        if i % 3 == 0:
+            number = next(_ids)
+            posting_service.querySession.add(Posting(
+                posting_id="ptest{:04d}".format(number), sender=sender, posting_type="dissemination",
+                posting_time=when, posting_topic="t", message="m", group_id="PPA"))
+        elif i % 3 == 1:
+            add_discussion(posting_service, sender, "m", when=when, status=("open", "processing")[i % 2])
+        else:
+            discussion = add_discussion(posting_service, sender, "m", when=base - timedelta(days=1))
+            add_reply(posting_service, discussion, sender, "r", when)
+    posting_service.querySession.commit()
+    return senders, moments
+
+
+@pytest.mark.parametrize("start, end", [
+    (datetime(2033, 1, 1, 10), datetime(2033, 1, 1, 14)),
+    (datetime(2033, 1, 1, 10, 30), datetime(2033, 1, 1, 13, 30)),
+    (datetime(2033, 1, 1, 9, 59, 59, 999999), datetime(2033, 1, 1, 14, 0, 0, 1)),
+    (datetime(2033, 1, 1, 11), datetime(2033, 1, 1, 12)),
+    (datetime(2033, 1, 1, 11, 15), datetime(2033, 1, 1, 11, 45)),
+    (datetime(2033, 1, 1, 0), datetime(2033, 1, 2, 0)),
+])
+def test_rollup_counts_match_raw_counts(posting_service, hour_edges, start, end):
+    senders, _ = hour_edges
+
+    report = posting_service.counting_report(senders, start.timestamp(), end.timestamp())
+
+    expected = raw_counts(posting_service, start, end)
+    assert report["users"] == [{"user_id": sender,
+                                "dissemination": expected.get(sender, {}).get("dissemination", 0),
+                                "discussion": expected.get(sender, {}).get("discussion", 0),
+                                "reply": expected.get(sender, {}).get("reply", 0)} for sender in senders]
+    assert report["involved_user"] == sum(1 for user in expected.values() if user.get("reply"))
+
+
+def test_rollup_follows_moderation_and_removal(posting_service, hour_edges):
+    senders, _ = hour_edges
+    start, end = datetime(2033, 1, 1, 9), datetime(2033, 1, 1, 16)
+    pending = posting_service.querySession.query(Posting) \
+        .filter(Posting.posting_status == "processing", Posting.posting_time > start).first()
+    opened = posting_service.querySession.query(Posting) \
+        .filter(Posting.posting_status == "open", Posting.posting_time > start).first()
+
+    pending.posting_status = "open"
+    opened.posting_status = "terminated"
+    posting_service.querySession.commit()
+    posting_service.remove_a_posting(posting_service.querySession.query(Reply)
+                                     .filter(Reply.posting_time > start).first().posting_id)
+
+    report = posting_service.counting_report(senders, start.timestamp(), end.timestamp())
+    expected = raw_counts(posting_service, start, end)
+    assert [(user["discussion"], user["reply"]) for user in report["users"]] == \
+        [(expected[sender].get("discussion", 0), expected[sender].get("reply", 0)) for sender in senders]
+
+
+def test_counting_info_for_one_user(posting_service, hour_edges):
+    senders, _ = hour_edges
+    start, end = datetime(2033, 1, 1, 10, 30), datetime(2033, 1, 1, 13, 30)
+
+    info = posting_service.counting_info(senders[0], start.timestamp(), end.timestamp())
+
+    assert info == expected_info(raw_counts(posting_service, start, end), senders[0])
+
+
+def test_report_for_all_senders(posting_service, hour_edges):
+    senders, _ = hour_edges
+    start, end = datetime(2033, 1, 1, 9), datetime(2033, 1, 1, 16)
+
+    report = posting_service.counting_report(None, start.timestamp(), end.timestamp())
+
+    assert [user["user_id"] for user in report["users"]] == sorted(senders)
+    assert report["total_reply"] == sum(user["reply"] for user in report["users"])
+    assert report["total_dissemination"] == sum(user["dissemination"] for user in report["users"])
+
+
+def test_report_lists_inactive_users_with_zero_counts(posting_service, hour_edges):
+    report = posting_service.counting_report(["nobody"], datetime(2033, 1, 1, 9).timestamp(),
+                                             datetime(2033, 1, 1, 16).timestamp())
+
+    assert report["users"] == [{"user_id": "nobody", "dissemination": 0, "discussion": 0, "reply": 0}]
+    assert report["total_reply"] > 0
+
+
+@pytest.fixture
+def moderated(posting_service, rpc):
+    """Routes add_posting and add_private_conversation through the queue with fresh event IDs."""
+    event_ids = ("etest{:04d}".format(next(_ids)) for _ in count())
+    rpc.user_service.check_user_type_by_id.return_value = "patient"
+    rpc.keyword_service.check_discussion_posting.return_value = True
+    rpc.event_service.add_event.side_effect = lambda **kwargs: next(event_ids)
+    rpc.event_service.approve.return_value = True
+    rpc.event_service.reject.return_value = True
+    return posting_service
+
+
+def test_pending_items_are_queued_with_sender_details(moderated, user_service):
+    patient, physician = [row[0] for row in user_service.querySession.query(User.user_id).limit(2)]
+    users = user_service.get_users_info([patient, physician])
+    event_id, _, _ = moderated.add_posting(patient, "discussion", "topic", "please approve", "PPA")
+    moderated.add_private_conversation(patient, physician, "private", "may we talk")
+
+    postings, privates = moderated.get_posting_list()
+
+    assert [(p["eventID"], p["senderName"], p["senderEmail"], p["message"]) for p in postings] == \
+        [(event_id, users[patient]["user_name"], users[patient]["email"], "please approve")]
+    assert [(p["patientName"], p["physicianName"], p["physicianEmail"], p["topic"]) for p in privates] == \
+        [(users[patient]["user_name"], users[physician]["user_name"], users[physician]["email"], "private")]
+
+
+def test_admin_postings_skip_the_queue(moderated, rpc, sender):
+    rpc.user_service.check_user_type_by_id.return_value = "admin"
+
+    moderated.add_posting(sender, "discussion", "topic", "announcement", "PPA")
+
+    assert moderated.get_posting_list() == ([], [])
+
+
+def test_approve_reject_and_remove_clear_queue_items(moderated, sender):
+    postings = [moderated.querySession.query(Posting).filter(Posting.event_id == event_id).one().posting_id
+                for event_id, _, _ in [moderated.add_posting(sender, "discussion", "topic", "m", "PPA")
+                                       for _ in range(4)]]
+
+    assert moderated.approve_posting(postings[0])
+    assert moderated.reject_posting(postings[1])
+    moderated.remove_a_posting(postings[2])
+
+    assert [item["postingID"] for item in moderated.get_posting_list()[0]] == postings[3:]
+
+
+def test_moderation_queue_pages_oldest_first_with_filters(moderated, user_service):
+    first, second = [row[0] for row in user_service.querySession.query(User.user_id).limit(2)]
+    for sender in [first, second, first, second, first]:
+        moderated.add_posting(sender, "discussion", "topic", "m", "PPA")
+    moderated.add_private_conversation(second, first, "private", "m")
+    queue = moderated.get_moderation_queue(limit=100)["items"]
+
+    assert [item["type"] for item in queue] == ["posting"] * 5 + ["private_request"]
+    assert page_through(lambda **kwargs: moderated.get_moderation_queue(item_type="posting", **kwargs),
+                        "items", 2) == [item["postingID"] for item in queue[:5]]
+    assert page_through(lambda **kwargs: moderated.get_moderation_queue(sender_id=first, **kwargs),
+                        "items", 2) == [item["postingID"] for item in queue[0:5:2]]
+    assert moderated.get_moderation_queue(cursor="not a cursor") is None
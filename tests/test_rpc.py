@@ -0,0 +1,153 @@
+# coding=utf-8
+from time import time, sleep
+from unittest import mock
+
+import pytest
+from nameko.exceptions import RemoteError, RpcTimeout
+
+from common import rpc
+
+
+@pytest.fixture
+def cluster_proxy():
+    with mock.patch.object(rpc, "ClusterRpcProxy") as cluster_proxy:
+        cluster_proxy.side_effect = lambda *args, **kwargs: mock.Mock()
+        yield cluster_proxy
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault("size", 2)
+    kwargs.setdefault("health_check_interval", 60)
+    return rpc.RpcProxyPool({"AMQP_URI": "memory://"}, **kwargs)
+
+
+def test_proxy_is_started_once_and_reused(cluster_proxy):
+    pool = make_pool()
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        pass
+    assert first is second
+    assert cluster_proxy.call_count == 1
+
+
+def test_concurrent_checkouts_get_different_proxies(cluster_proxy):
+    pool = make_pool()
+    with pool.acquire() as first, pool.acquire() as second:
+        assert first is not second
+
+
+def test_remote_error_keeps_the_proxy(cluster_proxy):
+    pool = make_pool()
+    with pytest.raises(RemoteError):
+        with pool.acquire() as proxy:
+            raise RemoteError("ValueError")
+    with pool.acquire() as again:
+        assert again is proxy
+
+
+def test_other_errors_drop_the_proxy(cluster_proxy):
+    pool = make_pool()
+    with pytest.raises(IOError):
+        with pool.acquire() as proxy:
+            raise IOError("connection reset")
+    cluster_proxy.side_effect = None
+    cluster_proxy.return_value.start.return_value = replacement = mock.Mock()
+    with pool.acquire() as again:
+        assert again is replacement
+    assert pool._created == 1
+
+
+def test_exhausted_pool_times_out(cluster_proxy):
+    pool = make_pool(size=1, acquire_timeout=0.01)
+    with pool.acquire():
+        with pytest.raises(rpc.PoolExhausted):
+            with pool.acquire():
+                pass
+
+
+def reply_connection(proxy_item):
+    return proxy_item.standalone._reply_listener.queue_consumer.connection
+
+
+def test_proxy_with_a_closed_connection_is_dropped(cluster_proxy):
+    pool = make_pool()
+    with pool.acquire() as proxy:
+        pass
+    reply_connection(pool._idle.queue[0]).connected = False
+    with pool.acquire() as again:
+        assert again is not proxy
+    assert pool._created == 1
+
+
+def test_idle_proxy_is_probed_on_its_own_connection(cluster_proxy):
+    pool = make_pool(health_check_interval=0)
+    with pool.acquire() as proxy:
+        pass
+    connection = reply_connection(pool._idle.queue[0])
+    with pool.acquire() as reused:
+        assert reused is proxy
+    connection.connection.send_heartbeat.assert_called_once_with()
+
+    connection.connection.send_heartbeat.side_effect = ConnectionResetError
+    with pool.acquire() as again:
+        assert again is not proxy
+
+
+def test_recently_used_proxy_skips_the_probe(cluster_proxy):
+    pool = make_pool()
+    with pool.acquire():
+        pass
+    connection = reply_connection(pool._idle.queue[0])
+    with pool.acquire():
+        pass
+    connection.connection.send_heartbeat.assert_not_called()
+
+
+def test_pool_size_defaults_to_max_workers(monkeypatch):
+    monkeypatch.delenv("RPC_POOL_SIZE", raising=False)
+
+    assert rpc.RpcProxyPool({"AMQP_URI": "memory://"}).size == rpc.POOL_SIZE
+
+
+def reply_after(seconds, value):
+    """A reply like call_async's, whose result arrives `seconds` after it was sent."""
+    arrives = time() + seconds
+    return mock.Mock(result=lambda: sleep(max(0, arrives - time())) or value)
+
+
+def test_gather_keeps_the_call_order():
+    assert rpc.gather([reply_after(0.03, "first"), reply_after(0.01, "second"), reply_after(0, "third")],
+                      timeout=1) == ["first", "second", "third"]
+
+
+def test_gather_waits_for_the_calls_concurrently():
+    started = time()
+
+    rpc.gather([reply_after(0.2, n) for n in range(5)], timeout=0.5)
+
+    assert time() - started < 0.5
+
+
+def test_gather_deadline_covers_all_replies():
+    started = time()
+
+    # each reply alone is within the timeout, together they are not
+    with pytest.raises(RpcTimeout):
+        rpc.gather([reply_after(0.2, "first"), reply_after(0.4, "second"), reply_after(0.7, "third")],
+                   timeout=0.5)
+
+    assert 0.5 <= time() - started < 0.7
+
+
+def test_gather_without_timeout_waits():
+    assert rpc.gather([reply_after(0.05, "late")]) == ["late"]
+
+
+def test_timed_out_proxy_is_dropped(cluster_proxy):
+    pool = make_pool()
+    with pytest.raises(RpcTimeout):
+        with pool.acquire() as proxy:
+            rpc.gather([reply_after(1, "late")], timeout=0.01)
+    with pool.acquire() as again:
+        assert again is not proxy
@@ -0,0 +1,83 @@
+# coding=utf-8
+from unittest import mock
+from uuid import uuid4
+
+import pytest
+
+from service.user import User
+
+
+def test_users_info_is_keyed_by_id(user_service):
+    user_ids = [user_id for user_id, in user_service.querySession.query(User.user_id).limit(3)]
+
+    users = user_service.get_users_info(user_ids + user_ids[:1] + ["nobody"])
+
+    assert sorted(users) == sorted(user_ids)
+    for user_id in user_ids:
+        assert users[user_id] == user_service.get_user_info(user_id)
+
+
+def test_users_info_over_the_variable_limit(user_service):
+    user_ids = [user_id for user_id, in user_service.querySession.query(User.user_id)]
+
+    users = user_service.get_users_info(["missing{}".format(i) for i in range(1200)] + user_ids)
+
+    assert sorted(users) == sorted(user_ids)
+
+
+def add_user(service, user_name, full_name, user_type="patient", status="approved"):
+    user = User(user_id=uuid4().hex, user_name=user_name, user_fullname=full_name, user_type=user_type,
+                user_status=status)
+    service.querySession.add(user)
+    service.querySession.commit()
+    return user
+
+
+@pytest.fixture
+def named_users(user_service):
+    for user_name, full_name in [("zed1", "Banana Split"), ("zed2", "Ana Lee"), ("zed3", "Ana"),
+                                 ("zed4", "Anastasia Ng")]:
+        add_user(user_service, user_name, full_name)
+    add_user(user_service, "zed5", "Ana Pending", status="Processing")
+    add_user(user_service, "zed6", "Ana Nurse", user_type="nurse")
+
+
+def names(result):
+    return [user["userName"] for user in result["users"]]
+
+
+def test_name_search_ranks_exact_then_prefix_then_substring(user_service, named_users):
+    assert names(user_service.search_user("ANA", "patient")) == ["Ana", "Ana Lee", "Anastasia Ng", "Banana Split"]
+
+
+def test_short_keywords_match_prefixes(user_service, named_users):
+    assert names(user_service.search_user("an", "patient")) == ["Ana", "Ana Lee", "Anastasia Ng"]
+    assert names(user_service.search_user("zed", None)) == ["Banana Split", "Ana Lee", "Ana", "Anastasia Ng",
+                                                            "Ana Nurse"]
+
+
+def test_search_pages_through_all_matches(user_service, named_users):
+    found = []
+    cursor = None
+    while True:
+        page = user_service.search_user("ana", "patient", limit=1, cursor=cursor)
+        found.extend(names(page))
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert found == names(user_service.search_user("ana", "patient"))
+
+
+def test_search_rejects_bad_input(user_service):
+    assert user_service.search_user("   ", None) == {"users": [], "next_cursor": None}
+    assert user_service.search_user("ana", None, cursor="not a cursor") is None
+
+
+def test_rejection_mail_is_dispatched_by_the_service(user_service):
+    user_id, email = user_service.querySession.query(User.user_id, User.user_email).first()
+
+    assert user_service.reject_user(user_id)
+
+    user_service.dispatch.assert_any_call("mail_requested", {"to": email, "subject": "Registration rejected",
+                                                             "content": mock.ANY})